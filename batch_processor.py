@@ -1,34 +1,205 @@
 import os
 import json
+import shutil
+import signal
 import logging
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
 from datetime import datetime
 from hybrid_extractor import HybridInvoiceExtractor
+from resource_manager import ResourceManager, set_resource_manager
+from staged_pipeline import StagedPipeline
+from results_store import ResultsStore, store_path_for, file_signature
+from exporter import ResultsExporter
+import telemetry
+from model_manager import get_model_manager
+from config import WATCH_SETTINGS, MODEL_SETTINGS, TROCR_MODELS, TIMEOUT_SETTINGS
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Supported image formats
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
+
+_worker_extractor = None
+
+
+class ImageTimeout(BaseException):
+    """Not an Exception: the engines' own except-Exception handlers must not swallow the budget"""
+
+
+@contextmanager
+def time_budget(seconds):
+    """Raise ImageTimeout in this process if the block runs longer than seconds"""
+    # Signals only reach the main thread, so pipelined stage threads rely on engine budgets
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _expired(signum, frame):
+        raise ImageTimeout(f"Image exceeded its {seconds}s budget")
+
+    previous = signal.signal(signal.SIGALRM, _expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _init_worker(core_budget, workers, pin_cpus, counter):
+    """Apply this worker's share of the core budget, then load models once"""
+    global _worker_extractor
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+    telemetry.setup_logging()
+    manager = set_resource_manager(ResourceManager(core_budget, workers, pin_cpus))
+    manager.apply(worker_index)
+    _worker_extractor = HybridInvoiceExtractor()
+
+
+def _process_in_worker(image_path):
+    try:
+        with time_budget(TIMEOUT_SETTINGS['image_seconds']):
+            return image_path, _worker_extractor.process_image(image_path), None
+    except (Exception, ImageTimeout) as e:
+        return image_path, None, str(e)
+
 
 class BatchInvoiceProcessor:
-    def __init__(self):
-        self.extractor = HybridInvoiceExtractor()
+    def __init__(self, resources=None, pipelined=False):
+        self.resources = resources or ResourceManager()
+        self.pipelined = pipelined
+        set_resource_manager(self.resources)
+        self.resources.apply()
+        # Worker processes load their own models
+        self.extractor = HybridInvoiceExtractor() if self.resources.workers == 1 else None
+        self.pool = None
+        telemetry.start_exporters()
+
+    def close(self):
+        """Shut down worker processes kept warm between calls"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        telemetry.flush_exporters()
+
+    def _process_serial(self, image_files):
+        for image_path in image_files:
+            try:
+                with time_budget(TIMEOUT_SETTINGS['image_seconds']):
+                    result = self.extractor.process_image(image_path)
+                yield image_path, result, None
+            except (Exception, ImageTimeout) as e:
+                yield image_path, None, str(e)
+
+    def _get_pool(self):
+        if self.pool is None:
+            resources = self.resources
+            if MODEL_SETTINGS['preload_for_workers'] and multiprocessing.get_start_method() == 'fork':
+                # Forked workers inherit the loaded weights copy-on-write instead of loading their own
+                get_model_manager().preload(TROCR_MODELS.values())
+            counter = multiprocessing.Value('i', 0)
+            self.pool = multiprocessing.Pool(resources.workers, initializer=_init_worker,
+                                             initargs=(resources.core_budget, resources.workers,
+                                                       resources.pin_cpus, counter))
+        return self.pool
+
+    def _process_parallel(self, image_files):
+        files = list(image_files)
+        image_seconds = TIMEOUT_SETTINGS['image_seconds']
+        # Backstop for workers that crash or hang where the in-process timer cannot fire
+        hard_timeout = image_seconds * TIMEOUT_SETTINGS['hard_timeout_factor'] if image_seconds else None
+
+        done = 0
+        while done < len(files):
+            # Pool's task thread iterates this slice while we wait, so it must never change underneath it
+            submitted = files[done:]
+            results = self._get_pool().imap(_process_in_worker, submitted)
+            try:
+                for _ in submitted:
+                    # imap yields in submission order, so the result awaited is always files[done]'s
+                    item = results.next(timeout=hard_timeout)
+                    done += 1
+                    yield item
+            except multiprocessing.TimeoutError:
+                stuck = files[done]
+                done += 1
+                logger.error(f"Worker gave no result for {stuck} in {hard_timeout:.0f}s; restarting workers")
+                # A lost task is never retried by Pool, so replace the workers and resubmit the rest
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+                yield stuck, None, f"Worker crashed or hung for over {hard_timeout:.0f}s"
+
+    def _process(self, image_files):
+        """Yield (image_path, result, error) using the configured execution mode"""
+        if self.resources.workers > 1:
+            logger.info(f"Using {self.resources.workers} workers: {self.resources.plan()}")
+            return self._observed(self._process_parallel(image_files))
+        elif self.pipelined:
+            return self._observed(StagedPipeline(self.extractor, self.resources).run(image_files))
+        return self._observed(self._process_serial(image_files))
+
+    def _observed(self, items):
+        """Record metrics for each result in the parent, whichever process produced it"""
+        start = time.perf_counter()
+        for count, (image_path, result, error) in enumerate(items, 1):
+            telemetry.record_result(result, error)
+            telemetry.IMAGES_PER_SECOND.set(round(count / (time.perf_counter() - start), 3))
+            yield image_path, result, error
+
+    def _quarantine(self, store, image_path, reason):
+        """Keep a timed-out or crashing input out of later runs"""
+        store.quarantine(image_path, reason)
+        telemetry.QUARANTINED.inc()
+        folder = TIMEOUT_SETTINGS['quarantine_folder']
+        if folder and os.path.exists(image_path):
+            os.makedirs(folder, exist_ok=True)
+            shutil.move(image_path, os.path.join(folder, os.path.basename(image_path)))
+        logger.warning(f"  Quarantined {os.path.basename(image_path)}: {reason}")
+
+    def _release_changed(self, store, signatures):
+        for image_path in store.release_changed(signatures):
+            logger.info(f"  Released {os.path.basename(image_path)} from quarantine: the file has changed")
+
+    def process_folder(self, input_folder, output_file="batch_results.json", export_path=None, profile_path=None):
+        """Process all images in a folder, optionally streaming rows to a Parquet/CSV export"""
+        # Profiling is opt-in per batch: .prof for cProfile, any other name for collapsed stacks
+        with telemetry.profiling(profile_path):
+            return self._process_folder(input_folder, output_file, export_path)
 
-    def process_folder(self, input_folder, output_file="batch_results.json"):
-        """Process all images in a folder"""
+    def _process_folder(self, input_folder, output_file, export_path):
         if not os.path.exists(input_folder):
             logger.error(f"Input folder does not exist: {input_folder}")
             return
 
-        # Supported image formats
-        image_extensions = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
-
         # Find all image files
         image_files = []
         for file in os.listdir(input_folder):
-            if file.lower().endswith(image_extensions):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
                 image_files.append(os.path.join(input_folder, file))
 
+        # Results are indexed as they arrive so view/analyze tools never reload the JSON
+        store = ResultsStore(store_path_for(output_file))
+
+        quarantined = store.quarantined()
+        if quarantined:
+            # A fixed copy uploaded over a quarantined file gets another chance
+            self._release_changed(store, {path: file_signature(path) for path in image_files if path in quarantined})
+            quarantined = store.quarantined()
+            skipped = [path for path in image_files if path in quarantined]
+            image_files = [path for path in image_files if path not in quarantined]
+            if skipped:
+                logger.warning(f"Skipping {len(skipped)} quarantined images (results_store.py --quarantined)")
+
         if not image_files:
             logger.error(f"No image files found in: {input_folder}")
+            store.close()
             return
 
         logger.info(f"Found {len(image_files)} images to process")
@@ -37,12 +208,12 @@ class BatchInvoiceProcessor:
         successful = 0
         failed = 0
 
-        for i, image_path in enumerate(image_files, 1):
-            logger.info(f"[{i}/{len(image_files)}] Processing: {os.path.basename(image_path)}")
+        exporter = ResultsExporter(export_path) if export_path else None
 
-            try:
-                # Process image
-                result = self.extractor.process_image(image_path)
+        for i, (image_path, result, error) in enumerate(self._process(image_files), 1):
+            logger.info(f"[{i}/{len(image_files)}] Processed: {os.path.basename(image_path)}")
+
+            if error is None:
                 results[image_path] = result
 
                 best_text = result.get('best_result', {}).get('text', '')
@@ -56,15 +227,22 @@ class BatchInvoiceProcessor:
                     failed += 1
                     logger.warning("  ⚠ No text extracted")
 
-            except Exception as e:
+            else:
                 failed += 1
-                logger.error(f"  ✗ Failed: {e}")
+                logger.error(f"  ✗ Failed: {error}")
                 results[image_path] = {
                     'file_path': image_path,
                     'timestamp': datetime.now().isoformat(),
-                    'error': str(e)
+                    'error': error
                 }
 
+            if 'error' in results[image_path]:
+                self._quarantine(store, image_path, results[image_path]['error'])
+
+            store.add_result(image_path, results[image_path])
+            if exporter is not None:
+                exporter.write(image_path, results[image_path])
+
         # Prepare final output
         output_data = {
             'metadata': {
@@ -81,29 +259,153 @@ class BatchInvoiceProcessor:
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(output_data, f, indent=2, ensure_ascii=False)
 
+        store.add_batch(output_data['metadata'])
+        store.mark_source(output_file)
+        store.close()
+        if exporter is not None:
+            exporter.close()
+
         logger.info(f"\n{'='*60}")
         logger.info("BATCH PROCESSING COMPLETED!")
         logger.info(f"{'='*60}")
         logger.info(f"Input folder: {input_folder}")
         logger.info(f"Output file: {output_file}")
+        logger.info(f"Results store: {store.db_path}")
+        if exporter is not None:
+            logger.info(f"Export: {export_path}")
         logger.info(f"Total processed: {len(image_files)}")
         logger.info(f"Successful: {successful}")
         logger.info(f"Failed: {failed}")
         logger.info(f"{'='*60}")
 
+        self.close()
         return output_data
 
+    def _scan(self, input_folder):
+        """Signature (mtime, size) of every image in the folder, from directory entries only"""
+        signatures = {}
+        with os.scandir(input_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    signatures[entry.path] = (stat.st_mtime, stat.st_size)
+        return signatures
+
+    def _change_notifier(self, input_folder):
+        """Event set on filesystem changes when watchdog is installed, else None"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            logger.info("watchdog not installed, falling back to mtime polling")
+            return None, None
+
+        changed = threading.Event()
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                changed.set()
+
+        observer = Observer()
+        observer.schedule(_Handler(), input_folder, recursive=False)
+        observer.start()
+        return changed, observer
+
+    def watch_folder(self, input_folder, output_file="batch_results.json", interval=None, once=False,
+                     export_path=None):
+        """Keep models warm and process only new or changed images as they appear"""
+        if not os.path.exists(input_folder):
+            logger.error(f"Input folder does not exist: {input_folder}")
+            return
+
+        interval = WATCH_SETTINGS['interval'] if interval is None else interval
+        store = ResultsStore(store_path_for(output_file))
+        # Watch mode writes no JSON, so readers must not re-import a stale one over these rows
+        store.mark_authoritative()
+        exporter = ResultsExporter(export_path) if export_path else None
+        changed, observer = (None, None) if once else self._change_notifier(input_folder)
+        logger.info(f"Watching {input_folder} (results store: {store.db_path})")
+
+        try:
+            while True:
+                ingested = store.ingest_state()
+                settled_before = time.time() - WATCH_SETTINGS['settle_seconds']
+                current = self._scan(input_folder)
+                self._release_changed(store, current)
+                quarantined = store.quarantined()
+                delta = [path for path, signature in sorted(current.items())
+                         if ingested.get(path) != signature and signature[0] <= settled_before
+                         and path not in quarantined]
+
+                if delta:
+                    logger.info(f"Found {len(delta)} new or changed images")
+                    for image_path, result, error in self._process(delta):
+                        if error is not None:
+                            logger.error(f"  ✗ Failed {os.path.basename(image_path)}: {error}")
+                            result = {
+                                'file_path': image_path,
+                                'timestamp': datetime.now().isoformat(),
+                                'error': error
+                            }
+                        else:
+                            text = result.get('best_result', {}).get('text', '')
+                            logger.info(f"  ✓ {os.path.basename(image_path)} - {len(text)} characters")
+                        store.add_result(image_path, result)
+                        store.mark_ingested(image_path, current[image_path])
+                        if exporter is not None:
+                            exporter.write(image_path, result)
+                        if 'error' in result:
+                            self._quarantine(store, image_path, result['error'])
+                    # One row group per scan, so rows are visible without waiting for row_group_size
+                    if exporter is not None:
+                        exporter.flush()
+
+                if once:
+                    break
+                if changed is not None:
+                    changed.wait(interval)
+                    changed.clear()
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Watch stopped")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            # A Parquet file is only readable once its footer is written on close
+            if exporter is not None:
+                exporter.close()
+            store.close()
+            self.close()
+
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) < 2:
-        print("Usage: python batch_processor.py <folder_path> [output_json]")
-        print("Example: python batch_processor.py invoice_image batch_results.json")
+    telemetry.setup_logging()
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    # --export=results.parquet (or .csv) streams flat rows alongside the JSON
+    export_path = next((arg.split('=', 1)[1] for arg in sys.argv[1:] if arg.startswith('--export=')), None)
+    # --profile=batch.prof (cProfile) or --profile=batch.folded (sampled stacks for flamegraphs)
+    profile_path = next((arg.split('=', 1)[1] for arg in sys.argv[1:] if arg.startswith('--profile=')), None)
+    pipelined = '--pipelined' in sys.argv
+    watch = '--watch' in sys.argv
+    # --once runs a single delta scan, for cron jobs that should skip already-ingested files
+    once = '--once' in sys.argv
+
+    if len(args) < 1:
+        print("Usage: python batch_processor.py <folder_path> [output_json] [workers] [--pipelined] [--export=out.parquet] [--profile=batch.prof] [--watch [--once]]")
+        print("Example: python batch_processor.py invoice_image batch_results.json 4")
         sys.exit(1)
 
-    folder_path = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "batch_results.json"
+    folder_path = args[0]
+    output_file = args[1] if len(args) > 1 else "batch_results.json"
+    workers = int(args[2]) if len(args) > 2 else None
 
-    processor = BatchInvoiceProcessor()
-    processor.process_folder(folder_path, output_file)
\ No newline at end of file
+    processor = BatchInvoiceProcessor(ResourceManager(workers=workers), pipelined=pipelined)
+    if watch:
+        processor.watch_folder(folder_path, output_file, once=once, export_path=export_path)
+    else:
+        processor.process_folder(folder_path, output_file, export_path, profile_path)
\ No newline at end of file
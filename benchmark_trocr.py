@@ -0,0 +1,144 @@
+import os
+import time
+import argparse
+from PIL import Image
+from telemetry import setup_logging
+from trocr_extractor import TRoCRExtractor
+from preprocessor import ImagePreprocessor
+from page_image import PageImage
+from model_manager import optimize_model
+from config import TROCR_INFERENCE
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
+
+
+def time_extraction(extractor, image, runs, lines=None):
+    """Return the best-of-N latency in milliseconds and the last result; with lines, the page is read line by line"""
+    best = None
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        if lines is None:
+            result = extractor.extract_with_confidence(image)
+        else:
+            result = extractor.extract_lines_with_confidence(image, lines)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def list_images(input_folder):
+    return sorted(
+        os.path.join(input_folder, f) for f in os.listdir(input_folder)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def benchmark_decoding(input_folder, model_type='printed', runs=3):
+    """Compare adaptive decoding against fixed num_beams=4, max_length=512 on each page's line crops"""
+    image_files = list_images(input_folder)
+    if not image_files:
+        print(f"No image files found in: {input_folder}")
+        return
+
+    extractor = TRoCRExtractor(model_type)
+    preprocessor = ImagePreprocessor()
+
+    print(f"TR-OCR DECODING BENCHMARK ({model_type}, best of {runs}, line crops)")
+    print("=" * 80)
+    print(f"{'File':<20} {'Lines':>5} {'Greedy':>6} {'Fixed ms':>10} {'Adaptive ms':>12} {'Speedup':>8}  Same text")
+    print("-" * 80)
+
+    total_fixed = 0.0
+    total_adaptive = 0.0
+    total_lines = 0
+    for image_path in image_files:
+        # The same page and line boxes the hybrid extractor decodes
+        page, _ = preprocessor.prepare_for_ocr(image_path)
+        lines = preprocessor.detect_text_lines(page.array)
+        extractor.adaptive_decoding = False
+        fixed_ms, fixed_result = time_extraction(extractor, page, runs, lines)
+        extractor.adaptive_decoding = True
+        adaptive_ms, adaptive_result = time_extraction(extractor, page, runs, lines)
+        greedy = sum(extractor.decoding_params(PageImage(page.array[y0:y1, x0:x1]), line=True)['num_beams'] == 1
+                     for x0, y0, x1, y1 in lines)
+        total_fixed += fixed_ms
+        total_adaptive += adaptive_ms
+        total_lines += len(lines)
+
+        same = fixed_result['text'] == adaptive_result['text']
+        print(f"{os.path.basename(image_path):<20} {len(lines):>5} {greedy:>6} {fixed_ms:>10.1f} {adaptive_ms:>12.1f} "
+              f"{fixed_ms / adaptive_ms:>7.2f}x  {same}")
+
+    print("-" * 80)
+    print(f"{'TOTAL':<20} {total_lines:>5} {'':>6} {total_fixed:>10.1f} {total_adaptive:>12.1f} "
+          f"{total_fixed / total_adaptive:>7.2f}x")
+    print(f"{'ms / line':<33} {total_fixed / total_lines:>10.1f} {total_adaptive / total_lines:>12.1f}")
+
+
+def benchmark_inference(input_folder, model_type='printed', runs=3):
+    """Per-image and per-token latency as inference_mode, a static KV cache and a compiled encoder are added in turn"""
+    image_files = list_images(input_folder)
+    if not image_files:
+        print(f"No image files found in: {input_folder}")
+        return
+
+    extractor = TRoCRExtractor(model_type)
+    images = [Image.open(image_path).convert('RGB') for image_path in image_files]
+
+    if extractor.models.stats()[extractor.model_name]['optimizations']:
+        print("Note: TROCR_INFERENCE already optimized the loaded model, so the baseline is not eager")
+
+    # Cumulative, eager first: compilation patches the shared model in place and cannot be undone
+    columns = []
+    extractor.inference_mode = False
+    columns.append(('Eager', [time_extraction(extractor, image, runs) for image in images]))
+    extractor.inference_mode = True
+    columns.append(('+inf_mode', [time_extraction(extractor, image, runs) for image in images]))
+    if optimize_model(extractor.model, dict(TROCR_INFERENCE, compile_encoder=False, static_cache=True)):
+        columns.append(('+static', [time_extraction(extractor, image, runs) for image in images]))
+    else:
+        print("Static KV cache unsupported for this model; skipped")
+    start = time.perf_counter()
+    optimize_model(extractor.model, dict(TROCR_INFERENCE, compile_encoder=True, static_cache=False))
+    # The first call pays for compilation; report it separately from steady-state latency
+    extractor.extract_with_confidence(images[0])
+    warmup_ms = (time.perf_counter() - start) * 1000
+    columns.append(('+compile', [time_extraction(extractor, image, runs) for image in images]))
+
+    print(f"TR-OCR INFERENCE BENCHMARK ({model_type}, best of {runs}, {extractor.device}); "
+          f"compile warm-up {warmup_ms:.0f} ms")
+    print("=" * 80)
+    print(f"{'File':<20} {'Tokens':>6}" + ''.join(f" {name + ' ms':>13}" for name, _ in columns))
+    print("-" * 80)
+
+    eager_results = columns[0][1]
+    # Tokens actually decoded for each image, up to and including end-of-sequence
+    tokens = [max(len(result.get('token_confidences', [])), 1) for _, result in columns[-1][1]]
+    for i, image_path in enumerate(image_files):
+        differs = any(timings[i][1]['text'] != eager_results[i][1]['text'] for _, timings in columns[1:])
+        print(f"{os.path.basename(image_path):<20} {tokens[i]:>6}" +
+              ''.join(f" {timings[i][0]:>13.1f}" for _, timings in columns) + ('  (text differs)' if differs else ''))
+
+    print("-" * 80)
+    totals = [sum(ms for ms, _ in timings) for _, timings in columns]
+    print(f"{'TOTAL ms':<20} {sum(tokens):>6}" + ''.join(f" {total:>13.1f}" for total in totals))
+    print(f"{'ms / token':<27}" + ''.join(f" {total / sum(tokens):>13.2f}" for total in totals))
+    print(f"{'Speedup vs eager':<27}" + ''.join(f" {totals[0] / total:>12.2f}x" for total in totals))
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Benchmark TR-OCR decoding settings")
+    parser.add_argument("input_folder", help="Folder of sample images", default="invoice_image", nargs='?')
+    parser.add_argument("--model", "-m", choices=['printed', 'handwritten'], default='printed')
+    parser.add_argument("--runs", "-r", type=int, default=3, help="Timed runs per image")
+    parser.add_argument("--inference", action="store_true",
+                        help="Compare eager no_grad against the compiled / inference_mode path instead")
+
+    args = parser.parse_args()
+    if args.inference:
+        benchmark_inference(args.input_folder, args.model, args.runs)
+    else:
+        benchmark_decoding(args.input_folder, args.model, args.runs)
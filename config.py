@@ -1,8 +1,16 @@
 import os
+import string
+
+# Characters the 'printed' config may output: ASCII letters and digits, invoice punctuation, currency
+# symbols and typographic quotes. ASCII quotes are left out because pytesseract shlex-splits the config.
+PRINTED_WHITELIST = string.digits + string.ascii_letters + '.,:;$/-()@&%#+*' + '₹€£¥‘’“”–'
+
+# Tesseract language packs, e.g. 'eng+hin'; each must be installed alongside Tesseract
+TESSERACT_LANGUAGES = 'eng'
 
 # Tesseract configuration
 TESSERACT_CONFIGS = {
-    'printed': '--psm 6 --oem 3 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,$/-()@& ',
+    'printed': '--psm 6 --oem 3 -c tessedit_char_whitelist=' + PRINTED_WHITELIST,
     'handwritten': '--psm 8 --oem 3',
     'auto': '--psm 6 --oem 3',
     'single_line': '--psm 8 --oem 3',
@@ -21,11 +29,172 @@ PREPROCESS_SETTINGS = {
     'min_height': 512,
     'max_width': 2048,
     'max_height': 2048,
-    'target_dpi': 300
+    'target_dpi': 300,
+    'deskew': True,
+    'deskew_max_angle': 15.0,   # Search range in degrees either side of horizontal
+    'deskew_min_angle': 0.3,    # Smaller estimated angles are left unrotated
+    'deskew_sample_width': 800,  # Width of the downsampled image used for estimation
+    'adaptive_profiles': True,  # False runs the full recipe on every image
+    'preprocess_engine_input': False,  # Also run profile steps on the image every engine reads (off in the baseline)
+    'noise_threshold': 2.0,     # Estimated noise std-dev (grey levels) above which images are denoised
+    'contrast_threshold': 80,   # Ink/paper separation (grey levels) below which contrast is boosted
+    'color_threshold': 12.0,    # Mean per-pixel channel spread above which an image is treated as a photo
+    'low_dpi': 150,
+    'low_resolution_height': 1000,  # Used instead of DPI when the file doesn't record one
+    'crop_to_text': True,
+    'crop_sample_width': 600,   # Width of the downsampled image used for text-block detection
+    'crop_padding': 0.02,       # Margin kept around the text, as a fraction of the shorter side
+    'crop_min_block_area': 0.0002,  # Blocks smaller than this fraction of the page are specks
+    'crop_min_saving': 0.1      # Skip cropping unless it removes at least this fraction of pixels
+}
+
+# Preprocessing steps per profile, in the order they run
+PREPROCESS_PROFILES = {
+    'full': ['contrast', 'denoise', 'sharpen', 'binarize'],
+    'photo': ['contrast', 'denoise', 'sharpen', 'binarize'],
+    'noisy': ['contrast', 'denoise', 'binarize'],
+    'low_resolution': ['contrast', 'sharpen', 'binarize'],
+    'low_contrast': ['contrast', 'binarize'],
+    'clean': ['binarize']
+}
+
+# Initial cost estimates in ms per megapixel (measured on a 1240x1753 page), refined as steps run
+PREPROCESS_STEP_COSTS = {
+    'contrast': 80.0,
+    'denoise': 2400.0,
+    'sharpen': 3.0,
+    'binarize': 5.0
 }
 
 # Set Tesseract path (Windows - update this path after installation)
 TESSERACT_PATHS = [
     r'C:\Program Files\Tesseract-OCR\tesseract.exe',  # Default installation path
     r'C:\Users\JHANANISHRI\AppData\Local\Programs\Tesseract-OCR\tesseract.exe'
-]
\ No newline at end of file
+]
+
+# TR-OCR decoding budget
+TROCR_DECODING = {
+    'adaptive': True,           # False restores fixed num_beams=4, max_length=512
+    'line_min_aspect': 4.0,     # Width/height from which a crop is one text line; pages keep the fixed budget
+    'char_aspect': 0.5,         # Average glyph width relative to line height
+    'chars_per_token': 3.0,     # Average characters per BPE token on invoice text
+    'token_margin': 1.5,        # Headroom over the estimated token count
+    'min_new_tokens': 24,
+    'max_new_tokens': 512,
+    'greedy_max_tokens': 64,    # Longer estimated outputs decode with beam search
+    'num_beams': 4,
+    'retry_confidence': None    # Re-decode greedy output with beams below this confidence
+}
+
+# TR-OCR inference path
+# TR-OCR reads single text lines; pages are split into line crops before decoding
+TROCR_LINES = {
+    'enabled': True,            # False decodes each page whole (before line crops existed)
+    'sample_width': 1200,       # Width of the downsampled image used for line detection
+    'rule_fraction': 25,        # Straight strokes longer than 1/rule_fraction of the page are table rules
+    'join_width': 0.015,        # Horizontal gap (fraction of sample width) bridged between glyphs of a line
+    'min_height': 6,            # Shorter blocks (sample pixels) are rules or specks
+    'max_height': 0.08,         # Taller blocks (fraction of sample height) are logos or pictures
+    'min_aspect': 1.0,          # Narrower blocks are stray marks, not text
+    'padding': 0.2,             # Margin around each line, as a fraction of its height
+    'max_lines': 120,           # Pages with more blocks than this are decoded whole
+    'batch_size': 16            # Line crops per generate call
+}
+
+TROCR_INFERENCE = {
+    'inference_mode': True,     # torch.inference_mode instead of no_grad (no autograd bookkeeping)
+    'compile_encoder': False,   # torch.compile the ViT encoder; inputs are always 384x384 so it compiles once
+    'compile_mode': None,       # torch.compile mode, e.g. 'max-autotune-no-cudagraphs'
+    'static_cache': False,      # Preallocated decoder KV cache, kept only if a trial decode with it works
+    'numpy_pixel_values': True  # Build pixel_values from the page buffer; False uses the HF image processor
+}
+
+# CPU budget shared by PyTorch, Tesseract (OpenMP) and batch workers
+RESOURCE_SETTINGS = {
+    'core_budget': None,        # None uses every core available to this process
+    'workers': 1,               # Batch worker processes
+    'pin_cpus': False,          # Pin each worker to its own slice of cores (Linux only)
+    'interop_threads': 1
+}
+
+# Staged pipeline (decode -> Tesseract -> TR-OCR) used by the batch processor
+PIPELINE_SETTINGS = {
+    'decode_workers': 2,
+    'tesseract_workers': None,  # None uses half of the worker's threads
+    'trocr_batch_size': 4,
+    'trocr_batch_timeout': 0.05,  # Seconds to wait for a fuller TR-OCR batch
+    'tesseract_queue_depth': 4,
+    'trocr_queue_depth': 8
+}
+
+# Folder watch mode for continuous ingestion
+WATCH_SETTINGS = {
+    'interval': 5.0,            # Seconds between mtime scans (wake-ups come sooner with watchdog)
+    'settle_seconds': 2.0       # Skip files modified more recently than this (still being written)
+}
+
+# TR-OCR model residency
+MODEL_SETTINGS = {
+    'memory_budget_mb': None,   # None keeps every loaded variant resident
+    'preload_for_workers': True,  # Load models before forking so workers share weight pages
+    'snapshot_folder': None  # Folder written by model_snapshot.py (relative to the repo); None keeps snapshots off
+}
+
+# Synthetic invoice rendering defaults (synthetic_invoices.py)
+SYNTHETIC_SETTINGS = {
+    'dpi': 150,
+    'noise': 0.0,               # Std-dev of Gaussian pixel noise, as a fraction of full scale
+    'skew': 0.0,                # Maximum absolute rotation in degrees
+    'handwriting': 0.0,         # Fraction of invoices filled in with a handwriting-like font
+    'pages': 1,                 # Minimum pages per invoice (items continue onto the next page)
+    'items': (4, 30),           # Line items per invoice (min, max)
+    'format': 'png',
+    'quality': 85
+}
+
+# Streaming Parquet/CSV export (exporter.py)
+EXPORT_SETTINGS = {
+    'row_group_size': 10000,    # Rows buffered before each row group is written
+    'compression': 'zstd'       # Parquet codec
+}
+
+# Coordinator/worker mode over a shared SQLite queue (work_queue.py)
+WORK_QUEUE_SETTINGS = {
+    'lease_seconds': 300,       # A lease not renewed for this long is handed to another worker
+    'heartbeat_interval': 60,
+    'claim_size': 8,            # Images leased per claim
+    'max_attempts': 3,          # Leases per image before it is marked failed
+    'poll_interval': 5.0
+}
+
+# Per-layout Tesseract config and profile cache (layout_cache.py)
+LAYOUT_SETTINGS = {
+    'enabled': True,
+    'cache_path': 'layout_cache.db',
+    'header_fraction': 0.15,    # Top of the cropped page hashed as the layout fingerprint
+    'max_distance': 8,          # Fingerprints within this many differing bits are the same layout
+    'learn_samples': 2,         # Consecutive wins before a layout runs only its learned config
+    'fallback_ratio': 0.5       # Sweep every config again if the learned one reads less than this share of usual
+}
+
+# Time budgets and poison-file isolation in the batch runner
+TIMEOUT_SETTINGS = {
+    'image_seconds': 300,       # Whole-image budget, enforced inside the process doing the work
+    'tesseract_seconds': 60,    # Per Tesseract config run (the tesseract process is killed)
+    'trocr_seconds': 120,       # Per generate call; decoding stops with a partial result
+    'hard_timeout_factor': 2.0,  # Parallel mode restarts a worker stuck past factor x image_seconds
+    'max_pixels': 100_000_000,  # Larger images are rejected from the header, before decoding
+    'quarantine_folder': None   # Move quarantined files here; None only records them in the store
+}
+
+# Logging, metrics and profiling (telemetry.py)
+TELEMETRY_SETTINGS = {
+    'log_level': 'INFO',
+    'quiet_loggers': ['PIL', 'urllib3', 'filelock', 'httpx'],
+    'metrics_port': None,       # Serve /metrics on this port (0 picks a free one)
+    'metrics_host': '127.0.0.1',
+    'metrics_file': None,       # Also rewrite this file with the metrics text every dump_interval
+    'dump_interval': 15.0,
+    'latency_buckets': (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    'profile_interval': 0.005   # Seconds between stack samples
+}
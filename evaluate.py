@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import time
+import argparse
+from PIL import Image
+from config import TESSERACT_CONFIGS
+from page_image import PageImage
+from synthetic_invoices import generate
+from telemetry import setup_logging
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
+
+# Engine subsets scored with the hybrid selector; cost is the sum of their latencies
+COMBINATIONS = {
+    'tesseract_all': ['tesseract:' + name for name in TESSERACT_CONFIGS],
+    'tesseract_auto+trocr_printed': ['tesseract:auto', 'trocr_printed'],
+    'tesseract_all+trocr_printed': ['tesseract:' + name for name in TESSERACT_CONFIGS] + ['trocr_printed'],
+    'hybrid (current)': ['tesseract:' + name for name in TESSERACT_CONFIGS] + ['trocr_printed', 'trocr_handwritten']
+}
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two sequences"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, item_a in enumerate(a, 1):
+        current = [i]
+        for j, item_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (item_a != item_b)))
+        previous = current
+    return previous[-1]
+
+
+def cer(hypothesis, reference):
+    reference = normalize(reference)
+    return edit_distance(normalize(hypothesis), reference) / max(len(reference), 1)
+
+
+def wer(hypothesis, reference):
+    reference_words = normalize(reference).split()
+    return edit_distance(normalize(hypothesis).split(), reference_words) / max(len(reference_words), 1)
+
+
+def load_ground_truth(image_folder, truth_folder):
+    """Pair each image with <truth_folder>/<image name without extension>.txt"""
+    samples = []
+    if not os.path.isdir(image_folder) or not os.path.isdir(truth_folder):
+        return samples
+    for file in sorted(os.listdir(image_folder)):
+        if not file.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        truth_path = os.path.join(truth_folder, os.path.splitext(file)[0] + '.txt')
+        if os.path.exists(truth_path):
+            with open(truth_path, 'r', encoding='utf-8') as f:
+                samples.append((os.path.join(image_folder, file), f.read()))
+    return samples
+
+
+def run_engines(extractor, image_path):
+    """Run every base engine once, returning {engine: (output, seconds)}"""
+    image = Image.open(image_path).convert('RGB')
+    outputs = {}
+    for config_name in TESSERACT_CONFIGS:
+        start = time.perf_counter()
+        text = extractor.tesseract.extract_text(image, config_name)
+        outputs['tesseract:' + config_name] = (text, time.perf_counter() - start)
+    timings = {}
+    page = PageImage.wrap(image)
+    lines = extractor.text_lines(page, timings)
+    for engine in ('trocr_printed', 'trocr_handwritten'):
+        start = time.perf_counter()
+        result = getattr(extractor, engine).extract_lines_with_confidence(page, lines)
+        # Either engine alone would pay for line detection
+        outputs[engine] = (result, time.perf_counter() - start + timings.get('line_detection', 0.0))
+    return outputs
+
+
+def combine(extractor, outputs, members):
+    """Text the hybrid selector would pick if only `members` had been run"""
+    tesseract_texts = {name.split(':', 1)[1]: outputs[name][0] for name in members if name.startswith('tesseract:')}
+    best_config = max(tesseract_texts, key=lambda name: len(tesseract_texts[name]), default='')
+    empty = {'text': '', 'confidence': 0.0}
+    results = {
+        'tesseract': {'best_text': tesseract_texts.get(best_config, ''), 'best_config': best_config},
+        'trocr_printed': outputs['trocr_printed'][0] if 'trocr_printed' in members else empty,
+        'trocr_handwritten': outputs['trocr_handwritten'][0] if 'trocr_handwritten' in members else empty
+    }
+    return extractor._select_best_result(results)['text']
+
+
+def pareto_frontier(rows):
+    """Rows not beaten on both cost and CER by a cheaper row"""
+    frontier = []
+    best_cer = None
+    for row in sorted(rows, key=lambda r: (r['seconds'], r['cer'])):
+        if best_cer is None or row['cer'] < best_cer:
+            frontier.append(row['name'])
+            best_cer = row['cer']
+    return frontier
+
+
+def evaluate(samples, extractor):
+    """Score every engine, config and combination on (image_path, reference) samples"""
+    totals = {}
+
+    def add(name, text, seconds, reference):
+        entry = totals.setdefault(name, {'name': name, 'cer': 0.0, 'wer': 0.0, 'seconds': 0.0})
+        entry['cer'] += cer(text, reference)
+        entry['wer'] += wer(text, reference)
+        entry['seconds'] += seconds
+
+    for image_path, reference in samples:
+        print(f"Evaluating {os.path.basename(image_path)}...")
+        outputs = run_engines(extractor, image_path)
+        for engine, (output, seconds) in outputs.items():
+            text = output['text'] if isinstance(output, dict) else output
+            add(engine, text, seconds, reference)
+        for name, members in COMBINATIONS.items():
+            seconds = sum(outputs[member][1] for member in members)
+            add(name, combine(extractor, outputs, members), seconds, reference)
+
+    rows = []
+    for entry in totals.values():
+        rows.append({key: value / len(samples) if key != 'name' else value for key, value in entry.items()})
+    frontier = pareto_frontier(rows)
+    for row in rows:
+        row['pareto'] = row['name'] in frontier
+    return sorted(rows, key=lambda r: r['seconds'])
+
+
+def print_report(rows):
+    print("\nACCURACY VS COST")
+    print("=" * 80)
+    print(f"{'Engine / combination':<32} {'ms/image':>10} {'CER':>8} {'WER':>8}  Pareto")
+    print("-" * 80)
+    for row in rows:
+        print(f"{row['name']:<32} {row['seconds'] * 1000:>10.0f} {row['cer']:>8.3f} {row['wer']:>8.3f}  "
+              f"{'*' if row['pareto'] else ''}")
+    print("-" * 80)
+    print("Pareto frontier (cheapest first): " + " -> ".join(r['name'] for r in rows if r['pareto']))
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Evaluate OCR accuracy against latency")
+    parser.add_argument("--images", default="invoice_image", help="Folder of real invoice images")
+    parser.add_argument("--truth", default="ground_truth", help="Folder of <image name>.txt transcriptions")
+    parser.add_argument("--synthetic", type=int, default=0, help="Also render and score N synthetic invoices")
+    parser.add_argument("--synthetic-dir", default="synthetic_eval")
+    parser.add_argument("--noise", type=float, default=0.0, help="Noise level for synthetic invoices")
+    parser.add_argument("--skew", type=float, default=0.0, help="Maximum skew in degrees for synthetic invoices")
+    parser.add_argument("--handwriting", type=float, default=0.0, help="Fraction of handwritten synthetic invoices")
+    parser.add_argument("--output", "-o", help="Write the report rows to this JSON file")
+
+    args = parser.parse_args()
+
+    samples = load_ground_truth(args.images, args.truth)
+    print(f"Found {len(samples)} images with ground truth in {args.truth}")
+
+    if args.synthetic:
+        samples += generate(args.synthetic, args.synthetic_dir, noise=args.noise, skew=args.skew,
+                            handwriting=args.handwriting)
+
+    if not samples:
+        print("Nothing to evaluate: add transcriptions to the truth folder or pass --synthetic N")
+        return
+
+    from hybrid_extractor import HybridInvoiceExtractor
+    rows = evaluate(samples, HybridInvoiceExtractor())
+    print_report(rows)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+        print(f"✓ Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import re
+import csv
+import ntpath
+import logging
+from results_store import open_results, record
+from config import EXPORT_SETTINGS
+from telemetry import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Header fields pulled from the best text; totals take the last match on the page
+FIELD_PATTERNS = {
+    'invoice_number': re.compile(r'Invoice\s*(?:No|Number|#)\.?\s*[:#\-]?\s*([A-Z0-9\-/]*\d[A-Z0-9\-/]*)', re.IGNORECASE),
+    'invoice_date': re.compile(r'Date\s*[:\-]?\s*(\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4})', re.IGNORECASE),
+    'gstin': re.compile(r'\b(\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z])\b'),
+    'total': re.compile(r'Total[^\d\n]*([\d,]+\.\d{2})', re.IGNORECASE)
+}
+
+TIMING_KEYS = ('load', 'deskew', 'crop', 'preprocess', 'tesseract', 'trocr_printed', 'trocr_handwritten')
+
+# (column, Arrow type name); CSV uses the same column order
+COLUMNS = [
+    ('file_path', 'string'), ('file_name', 'string'), ('processed_at', 'string'), ('error', 'string'),
+    ('best_method', 'string'), ('best_confidence', 'float64'), ('best_text', 'string'), ('text_length', 'int64'),
+    ('tesseract_config', 'string'), ('tesseract_text', 'string'),
+    ('trocr_printed_text', 'string'), ('trocr_printed_confidence', 'float64'), ('trocr_printed_beams', 'int64'),
+    ('trocr_handwritten_text', 'string'), ('trocr_handwritten_confidence', 'float64'),
+    ('trocr_handwritten_beams', 'int64'),
+    ('preprocess_profile', 'string'), ('skew_angle', 'float64'), ('crop_fraction', 'float64')
+] + [('seconds_' + key, 'float64') for key in TIMING_KEYS] + [(field, 'string') for field in FIELD_PATTERNS]
+
+
+def extract_fields(text):
+    fields = {}
+    for field, pattern in FIELD_PATTERNS.items():
+        matches = pattern.findall(text or '')
+        fields[field] = (matches[-1] if field == 'total' else matches[0]) if matches else None
+    return fields
+
+
+def flatten(file_path, result):
+    """One flat export row for a per-image result record"""
+    best = result.get('best_result', {})
+    engines = result.get('all_results', {})
+    tesseract = engines.get('tesseract', {})
+    printed = engines.get('trocr_printed', {})
+    handwritten = engines.get('trocr_handwritten', {})
+    timings = result.get('stage_timings', {})
+    text = best.get('text', '')
+
+    row = {
+        'file_path': file_path,
+        'file_name': ntpath.basename(file_path),
+        'processed_at': result.get('timestamp'),
+        'error': result.get('error'),
+        'best_method': best.get('method'),
+        'best_confidence': best.get('confidence'),
+        'best_text': text,
+        'text_length': len(text),
+        'tesseract_config': tesseract.get('best_config'),
+        'tesseract_text': tesseract.get('best_text'),
+        'trocr_printed_text': printed.get('text'),
+        'trocr_printed_confidence': printed.get('confidence'),
+        'trocr_printed_beams': printed.get('num_beams'),
+        'trocr_handwritten_text': handwritten.get('text'),
+        'trocr_handwritten_confidence': handwritten.get('confidence'),
+        'trocr_handwritten_beams': handwritten.get('num_beams'),
+        'preprocess_profile': timings.get('profile'),
+        'skew_angle': timings.get('skew_angle'),
+        'crop_fraction': timings.get('crop_fraction')
+    }
+    for key in TIMING_KEYS:
+        row['seconds_' + key] = timings.get(key)
+    row.update(extract_fields(text))
+    return row
+
+
+class ResultsExporter:
+    """Streams result rows to Parquet or CSV, one row group at a time"""
+
+    def __init__(self, output_path, row_group_size=None):
+        self.output_path = output_path
+        self.row_group_size = row_group_size or EXPORT_SETTINGS['row_group_size']
+        self.format = 'parquet' if output_path.endswith(('.parquet', '.pq')) else 'csv'
+        self.buffer = []
+        self.rows_written = 0
+        self.writer = None
+
+        if self.format == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("Parquet export needs pyarrow (pip install pyarrow); "
+                                  "use a .csv output path instead")
+            self.schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in COLUMNS])
+            self.writer = pq.ParquetWriter(output_path, self.schema, compression=EXPORT_SETTINGS['compression'])
+        else:
+            self.file = open(output_path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=[name for name, _ in COLUMNS])
+            self.writer.writeheader()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, file_path, result):
+        self.buffer.append(flatten(file_path, result))
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows as one row group"""
+        if not self.buffer:
+            return
+        if self.format == 'parquet':
+            import pyarrow as pa
+            columns = {name: [row[name] for row in self.buffer] for name, _ in COLUMNS}
+            self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+        else:
+            self.writer.writerows(self.buffer)
+            self.file.flush()
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.flush()
+        if self.format == 'parquet':
+            self.writer.close()
+        else:
+            self.file.close()
+        self.writer = None
+        logger.info(f"Exported {self.rows_written} rows to {self.output_path}")
+
+
+def export_results(results_file, output_path, row_group_size=None):
+    """Stream every stored result into a Parquet or CSV file"""
+    store = open_results(results_file)
+    try:
+        with ResultsExporter(output_path, row_group_size) as exporter:
+            for row in store.iter_results():
+                exporter.write(row['file_path'], record(row))
+    finally:
+        store.close()
+    return exporter.rows_written
+
+
+def main():
+    import argparse
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Export results to Parquet or CSV with per-engine columns")
+    parser.add_argument("results_file", help="Results .db file or results JSON")
+    parser.add_argument("output", help="Output path ending in .parquet or .csv")
+    parser.add_argument("--row-group-size", type=int, default=EXPORT_SETTINGS['row_group_size'])
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.results_file):
+        print(f"Error: Results file '{args.results_file}' not found")
+        return
+
+    try:
+        rows = export_results(args.results_file, args.output, args.row_group_size)
+    except ImportError as e:
+        print(f"Error: {e}")
+        return
+    print(f"✓ {rows} results exported to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,12 @@ import logging
 from tesseract_extractor import TesseractExtractor
 from trocr_extractor import TRoCRExtractor
 from preprocessor import ImagePreprocessor
+from layout_cache import LayoutCache
+from config import LAYOUT_SETTINGS, TESSERACT_CONFIGS, TROCR_LINES
 import json
+import time
 from datetime import datetime
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class HybridInvoiceExtractor:
@@ -13,7 +15,8 @@ class HybridInvoiceExtractor:
         logger.info("Initializing Hybrid OCR System...")
         
         # Initialize components
-        self.preprocessor = ImagePreprocessor()
+        self.layouts = LayoutCache() if LAYOUT_SETTINGS['enabled'] else None
+        self.preprocessor = ImagePreprocessor(self.layouts)
         self.tesseract = TesseractExtractor()
         self.trocr_printed = TRoCRExtractor('printed')
         self.trocr_handwritten = TRoCRExtractor('handwritten')
@@ -26,37 +29,78 @@ class HybridInvoiceExtractor:
         
         results = {}
         
+        # Decode and deskew once; every engine sees the same straightened image
+        image, stage_timings = self.preprocessor.prepare_for_ocr(image_path)
+        
         # Method 1: Tesseract with multiple configurations
         logger.info("Running Tesseract OCR...")
-        tesseract_results = self.tesseract.extract_with_multiple_configs(image_path)
+        start = time.perf_counter()
+        tesseract_results = self.run_tesseract(image, stage_timings)
         results['tesseract'] = tesseract_results
+        stage_timings['tesseract'] = time.perf_counter() - start
+        
+        # Both TR-OCR variants read the same line crops
+        lines = self.text_lines(image, stage_timings)
         
         # Method 2: TR-OCR Printed
         logger.info("Running TR-OCR Printed...")
+        start = time.perf_counter()
         try:
-            trocr_printed_result = self.trocr_printed.extract_with_confidence(image_path)
+            trocr_printed_result = self.trocr_printed.extract_lines_with_confidence(image, lines)
             results['trocr_printed'] = trocr_printed_result
         except Exception as e:
             logger.error(f"TR-OCR Printed failed: {e}")
             results['trocr_printed'] = {'text': '', 'confidence': 0.0}
+        stage_timings['trocr_printed'] = time.perf_counter() - start
         
         # Method 3: TR-OCR Handwritten
         logger.info("Running TR-OCR Handwritten...")
+        start = time.perf_counter()
         try:
-            trocr_handwritten_result = self.trocr_handwritten.extract_with_confidence(image_path)
+            trocr_handwritten_result = self.trocr_handwritten.extract_lines_with_confidence(image, lines)
             results['trocr_handwritten'] = trocr_handwritten_result
         except Exception as e:
             logger.error(f"TR-OCR Handwritten failed: {e}")
             results['trocr_handwritten'] = {'text': '', 'confidence': 0.0}
+        stage_timings['trocr_handwritten'] = time.perf_counter() - start
         
         # Determine best result
-        best_result = self._select_best_result(results)
+        return self.combine_results(results, stage_timings)
+    
+    def text_lines(self, image, stage_timings):
+        """Line boxes for TR-OCR, or None to decode the page whole"""
+        if not TROCR_LINES['enabled']:
+            return None
+        start = time.perf_counter()
+        lines = self.preprocessor.detect_text_lines(image.array)
+        stage_timings['line_detection'] = time.perf_counter() - start
+        stage_timings['lines'] = len(lines)
+        if len(lines) > TROCR_LINES['max_lines']:
+            logger.info(f"{len(lines)} text blocks is more than a page of lines; decoding the page whole")
+            return None
+        return lines
+    
+    def run_tesseract(self, image, stage_timings):
+        """Run only the learned config for a known layout, else try every config and learn the winner"""
+        layout = stage_timings.get('layout')
+        config_name = stage_timings.get('layout_config')
+        results = None
         
-        return {
-            'best_result': best_result,
-            'all_results': results,
-            'timestamp': datetime.now().isoformat()
-        }
+        if config_name in TESSERACT_CONFIGS:
+            results = self.tesseract.extract_with_multiple_configs(image, [config_name])
+            entry = self.layouts.match(layout)
+            expected = (entry['avg_chars'] or 0) * LAYOUT_SETTINGS['fallback_ratio'] if entry else 0
+            if not results['best_text'] or len(results['best_text']) < expected:
+                logger.info(f"Layout {layout}: '{config_name}' read {len(results['best_text'])} characters, "
+                            f"expected ~{expected:.0f}; trying every config")
+                results = None
+        
+        if results is None:
+            results = self.tesseract.extract_with_multiple_configs(image)
+        if layout and self.layouts is not None:
+            self.layouts.record(layout, results['best_config'], stage_timings.get('profile'),
+                                len(results['best_text']))
+        return results
     
     def _select_best_result(self, results):
         """Select the best result from all methods"""
@@ -100,6 +144,25 @@ class HybridInvoiceExtractor:
         
         return best_candidate
     
+    def build_output(self, image_path, extraction_results):
+        """Shape extraction results into the per-image output record"""
+        return {
+            'file_path': image_path,
+            'timestamp': extraction_results['timestamp'],
+            'best_result': extraction_results['best_result'],
+            'all_results': extraction_results['all_results'],
+            'stage_timings': extraction_results.get('stage_timings', {})
+        }
+    
+    def combine_results(self, results, stage_timings=None):
+        """Pick the best engine output from per-engine results"""
+        return {
+            'best_result': self._select_best_result(results),
+            'all_results': results,
+            'stage_timings': stage_timings or {},
+            'timestamp': datetime.now().isoformat()
+        }
+    
     def process_image(self, image_path, output_json=None):
         """Complete processing pipeline for a single image"""
         try:
@@ -107,12 +170,7 @@ class HybridInvoiceExtractor:
             extraction_results = self.extract_text_hybrid(image_path)
             
             # Prepare output
-            output_data = {
-                'file_path': image_path,
-                'timestamp': extraction_results['timestamp'],
-                'best_result': extraction_results['best_result'],
-                'all_results': extraction_results['all_results']
-            }
+            output_data = self.build_output(image_path, extraction_results)
             
             # Save to file if requested
             if output_json:
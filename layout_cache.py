@@ -0,0 +1,121 @@
+import cv2
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+import telemetry
+from config import LAYOUT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS layouts (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    config TEXT,
+    profile TEXT,
+    votes INTEGER NOT NULL DEFAULT 0,
+    samples INTEGER NOT NULL DEFAULT 0,
+    avg_chars REAL,
+    updated_at REAL
+);
+"""
+
+
+def header_fingerprint(image, header_fraction=None):
+    """64-bit perceptual hash (hex) of the top of a page, where supplier logos and headers sit"""
+    header_fraction = header_fraction or LAYOUT_SETTINGS['header_fraction']
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if len(image.shape) == 3 else image
+    header = gray[:max(8, int(gray.shape[0] * header_fraction))]
+    small = cv2.resize(header, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    # Low DCT frequencies describe the block layout, not the exact text
+    low = cv2.dct(small)[:8, :8].flatten()[1:]
+    bits = low > np.median(low)
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+class LayoutCache:
+    """Best Tesseract config and preprocessing profile learned per layout fingerprint"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or LAYOUT_SETTINGS['cache_path']
+        # Tesseract stage threads share one connection
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.entries = []
+        self._reload()
+
+    def _reload(self):
+        self.entries = [dict(row) for row in self.conn.execute("SELECT * FROM layouts")]
+
+    def _match(self, fingerprint):
+        best, best_distance = None, LAYOUT_SETTINGS['max_distance'] + 1
+        for entry in self.entries:
+            distance = hamming(fingerprint, entry['fingerprint'])
+            if distance < best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def match(self, fingerprint):
+        """Cached entry for a layout, or None"""
+        if not fingerprint:
+            return None
+        with self.lock:
+            entry = self._match(fingerprint)
+            if entry is None:
+                # Other workers may have learned this layout since we last read the table
+                self._reload()
+                entry = self._match(fingerprint)
+        return entry
+
+    def lookup(self, fingerprint):
+        """match(), counted in the cache metrics"""
+        entry = self.match(fingerprint)
+        telemetry.CACHE.inc(cache='layouts', result='hit' if self.is_learned(entry) else 'miss')
+        return entry
+
+    def is_learned(self, entry):
+        """The same config has won often enough in a row to be trusted alone"""
+        return entry is not None and entry['votes'] >= LAYOUT_SETTINGS['learn_samples']
+
+    def record(self, fingerprint, config, profile, chars):
+        """Count a config's win for this layout; a different winner restarts the vote"""
+        if not fingerprint or not config:
+            return
+        with self.lock:
+            entry = self._match(fingerprint)
+            now = time.time()
+            if entry is None:
+                cursor = self.conn.execute(
+                    "INSERT INTO layouts (fingerprint, config, profile, votes, samples, avg_chars, updated_at) "
+                    "VALUES (?, ?, ?, 1, 1, ?, ?)",
+                    (fingerprint, config, profile, chars, now)
+                )
+                self.entries.append({'id': cursor.lastrowid, 'fingerprint': fingerprint, 'config': config,
+                                     'profile': profile, 'votes': 1, 'samples': 1, 'avg_chars': chars,
+                                     'updated_at': now})
+                logger.info(f"New layout {fingerprint}: {config}")
+            else:
+                entry['votes'] = entry['votes'] + 1 if entry['config'] == config else 1
+                entry['config'] = config
+                entry['profile'] = profile or entry['profile']
+                entry['samples'] += 1
+                entry['avg_chars'] = 0.8 * (entry['avg_chars'] or chars) + 0.2 * chars
+                entry['updated_at'] = now
+                self.conn.execute(
+                    "UPDATE layouts SET config = ?, profile = ?, votes = ?, samples = ?, avg_chars = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (entry['config'], entry['profile'], entry['votes'], entry['samples'], entry['avg_chars'],
+                     now, entry['id'])
+                )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
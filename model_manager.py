@@ -0,0 +1,164 @@
+import gc
+import time
+import logging
+import threading
+from collections import OrderedDict
+import telemetry
+from config import MODEL_SETTINGS, TROCR_INFERENCE
+from model_snapshot import load_snapshot
+
+logger = logging.getLogger(__name__)
+
+_current = None
+
+
+def model_size_mb(model):
+    """Resident size of a model's parameters and buffers"""
+    total = sum(p.numel() * p.element_size() for p in model.parameters())
+    total += sum(b.numel() * b.element_size() for b in model.buffers())
+    return total / (1024 * 1024)
+
+
+def optimize_model(model, settings=None):
+    """Apply the configured compiled / cached inference options in place; returns what was applied"""
+    import torch
+
+    settings = settings or TROCR_INFERENCE
+    applied = []
+    # Before compiling, so the trial decode does not pay for compilation
+    if settings['static_cache']:
+        if _static_cache_works(model):
+            model.generation_config.cache_implementation = 'static'
+            applied.append('static_cache')
+        else:
+            logger.info(f"{type(model.decoder).__name__} cannot decode with a static cache; keeping the dynamic KV cache")
+
+    if settings['compile_encoder'] and hasattr(torch, 'compile'):
+        encoder = model.get_encoder()
+        # Compiling in place keeps parameter names, so state dicts are unchanged; compilation
+        # itself happens lazily on the first call in each process
+        if hasattr(encoder, 'compile'):
+            encoder.compile(mode=settings['compile_mode'], dynamic=False)
+        else:
+            encoder.forward = torch.compile(encoder.forward, mode=settings['compile_mode'], dynamic=False)
+        applied.append('compiled_encoder')
+    return applied
+
+
+def _static_cache_works(model):
+    """Try a two-token static-cache decode; support flags differ too much across transformers versions"""
+    import torch
+
+    encoder = model.config.encoder
+    pixel_values = torch.zeros(1, encoder.num_channels, encoder.image_size, encoder.image_size,
+                               device=model.device, dtype=model.dtype)
+    try:
+        with torch.inference_mode():
+            model.generate(pixel_values, max_new_tokens=2, num_beams=1, cache_implementation='static')
+        return True
+    except Exception as e:
+        logger.debug(f"Static cache trial failed: {e}")
+        return False
+
+
+class ModelManager:
+    """Loads TR-OCR variants on demand and evicts rarely used ones under a memory budget"""
+
+    def __init__(self, memory_budget_mb=None, device=None):
+        self.memory_budget_mb = memory_budget_mb if memory_budget_mb is not None else MODEL_SETTINGS['memory_budget_mb']
+        self.device = device
+        self.lock = threading.RLock()
+        # model_name -> entry, least recently used first
+        self.entries = OrderedDict()
+
+    def resident_mb(self):
+        return sum(entry['size_mb'] for entry in self.entries.values())
+
+    def _load(self, model_name):
+        import torch
+        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+        logger.info(f"Loading TR-OCR model: {model_name}")
+        start = time.perf_counter()
+        snapshot = None
+        try:
+            snapshot = load_snapshot(model_name)
+        except Exception as e:
+            logger.warning(f"Could not load the snapshot of {model_name}, using the hub cache: {e}")
+        if snapshot is not None:
+            processor, model, info = snapshot
+            source = f"snapshot ({info.get('quantize') or 'float32'})"
+        else:
+            processor = TrOCRProcessor.from_pretrained(model_name)
+            # from_pretrained prefers (memory-mapped) safetensors and falls back to pytorch_model.bin
+            model = VisionEncoderDecoderModel.from_pretrained(model_name, low_cpu_mem_usage=True)
+            source = 'hub cache'
+        device = self.device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+        model.eval()
+        # Weights are never written after loading, so pages stay shared with forked workers
+        for param in model.parameters():
+            param.requires_grad_(False)
+        optimizations = optimize_model(model)
+
+        entry = {
+            'processor': processor,
+            'model': model,
+            'size_mb': model_size_mb(model),
+            'uses': 0,
+            'optimizations': optimizations,
+            'source': source,
+            'load_seconds': time.perf_counter() - start
+        }
+        telemetry.MODEL_LOAD_SECONDS.observe(entry['load_seconds'], model=model_name)
+        logger.info(f"Loaded {model_name} ({entry['size_mb']:.0f} MB) from {source} in {entry['load_seconds']:.1f}s")
+        return entry
+
+    def _evict_for(self, incoming_mb):
+        """Drop least-used models until incoming_mb fits in the budget"""
+        if not self.memory_budget_mb:
+            return
+        while self.entries and self.resident_mb() + incoming_mb > self.memory_budget_mb:
+            # Fewest uses goes first; ties go to the least recently used
+            victim = min(self.entries, key=lambda name: self.entries[name]['uses'])
+            logger.info(f"Evicting {victim} to stay within {self.memory_budget_mb} MB")
+            telemetry.CACHE.inc(cache='models', result='evict')
+            del self.entries[victim]
+            gc.collect()
+
+    def get(self, model_name):
+        """Return (processor, model), loading and evicting as needed"""
+        with self.lock:
+            entry = self.entries.get(model_name)
+            telemetry.CACHE.inc(cache='models', result='hit' if entry is not None else 'miss')
+            if entry is None:
+                estimate = max((e['size_mb'] for e in self.entries.values()), default=0)
+                self._evict_for(estimate)
+                entry = self._load(model_name)
+                self._evict_for(entry['size_mb'])
+                self.entries[model_name] = entry
+            self.entries.move_to_end(model_name)
+            entry['uses'] += 1
+            return entry['processor'], entry['model']
+
+    def preload(self, model_names):
+        """Load models in this process so forked workers share their pages"""
+        for model_name in model_names:
+            self.get(model_name)
+        # Keep the garbage collector from touching (and so copying) pre-fork objects in workers
+        gc.collect()
+        gc.freeze()
+
+    def stats(self):
+        with self.lock:
+            return {name: {'size_mb': round(entry['size_mb'], 1), 'uses': entry['uses'],
+                           'optimizations': entry['optimizations'], 'source': entry['source']}
+                    for name, entry in self.entries.items()}
+
+
+def get_model_manager():
+    """Process-wide model manager, created from config on first use"""
+    global _current
+    if _current is None:
+        _current = ModelManager()
+    return _current
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from config import MODEL_SETTINGS, TROCR_MODELS
+from telemetry import setup_logging
+
+logger = logging.getLogger(__name__)
+
+INFO_FILE = 'snapshot.json'
+QUANTIZE_CHOICES = ('qint8', 'float16', 'bfloat16')
+
+# Relative snapshot folders in config resolve here, not against whatever directory a CLI runs from
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def snapshot_folder():
+    """Configured snapshot folder as an absolute path, or None when snapshots are off"""
+    folder = MODEL_SETTINGS['snapshot_folder']
+    if not folder:
+        return None
+    return folder if os.path.isabs(folder) else os.path.join(REPO_DIR, folder)
+
+
+def snapshot_path(model_name, folder=None):
+    """Directory holding the snapshot for a model, whether or not it has been written"""
+    folder = folder or snapshot_folder()
+    if folder is None:
+        return None
+    return os.path.join(folder, model_name.replace('/', '__'))
+
+
+def write_snapshot(model_name, folder, quantize=None):
+    """Load a model from the hub cache once and write a ready-to-load local snapshot; returns its path"""
+    import torch
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+    path = snapshot_path(model_name, folder)
+    os.makedirs(path, exist_ok=True)
+
+    processor = TrOCRProcessor.from_pretrained(model_name)
+    model = VisionEncoderDecoderModel.from_pretrained(model_name, low_cpu_mem_usage=True)
+    if quantize in ('float16', 'bfloat16'):
+        model = model.to(getattr(torch, quantize))
+
+    # Writes tokenizer.json, so loading skips the slow-to-fast tokenizer conversion
+    processor.save_pretrained(path)
+    # config.json plus one model.safetensors file: no shards to resolve, and the weights are
+    # memory-mapped while loading
+    model.save_pretrained(path, safe_serialization=True, max_shard_size='100GB')
+
+    info = {
+        'model_name': model_name,
+        'dtype': str(model.dtype).replace('torch.', ''),
+        # Dynamic int8 layers have no safetensors form, so they are rebuilt at load time
+        'quantize': quantize,
+        'created': datetime.now().isoformat()
+    }
+    with open(os.path.join(path, INFO_FILE), 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+    logger.info(f"Snapshot of {model_name} written to {path} ({quantize or info['dtype']})")
+    return path
+
+
+def load_snapshot(model_name, folder=None):
+    """(processor, model, info) from a snapshot, or None if snapshots are off or none was written"""
+    path = snapshot_path(model_name, folder)
+    if path is None or not os.path.exists(os.path.join(path, INFO_FILE)):
+        return None
+
+    import torch
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+    with open(os.path.join(path, INFO_FILE), encoding='utf-8') as f:
+        info = json.load(f)
+
+    # A local directory: no hub lookups, and safetensors holds no code to execute
+    processor = TrOCRProcessor.from_pretrained(path)
+    model = VisionEncoderDecoderModel.from_pretrained(path, low_cpu_mem_usage=True,
+                                                      torch_dtype=getattr(torch, info['dtype']))
+    model.eval()
+    if info.get('quantize') == 'qint8':
+        # Linear layers to int8 with dynamic activation scales, for CPU inference
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return processor, model, info
+
+
+def main():
+    import argparse
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Write warm-start TR-OCR snapshots for fast worker start-up")
+    parser.add_argument("--models", "-m", nargs='+', choices=list(TROCR_MODELS), default=list(TROCR_MODELS))
+    parser.add_argument("--output", "-o", default=snapshot_folder() or os.path.join(REPO_DIR, 'model_snapshots'),
+                        help="Snapshot folder (default: MODEL_SETTINGS['snapshot_folder'] or model_snapshots/)")
+    parser.add_argument("--quantize", "-q", choices=QUANTIZE_CHOICES,
+                        help="qint8 for CPU inference, float16/bfloat16 for GPU; default keeps float32")
+
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    for model_type in args.models:
+        model_name = TROCR_MODELS[model_type]
+        write_snapshot(model_name, output, args.quantize)
+        # Load it back so a broken snapshot is caught here rather than in every worker
+        start = time.perf_counter()
+        load_snapshot(model_name, output)
+        print(f"{model_name}: snapshot loads in {time.perf_counter() - start:.2f}s")
+
+    if snapshot_folder() != output:
+        print(f"Snapshots are only used once MODEL_SETTINGS['snapshot_folder'] = {output!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class PageImage:
+    """One contiguous uint8 page buffer (H x W greyscale or H x W x 3 RGB) shared by every engine"""
+
+    def __init__(self, array):
+        # Cropping leaves a strided view; this is the one copy made to hand the page on
+        self.array = np.ascontiguousarray(array, dtype=np.uint8)
+
+    @classmethod
+    def wrap(cls, image):
+        """A PageImage from a path, numpy array, PIL image or PageImage, converting only when needed"""
+        if isinstance(image, PageImage):
+            return image
+        if isinstance(image, str):
+            image = Image.open(image)
+        if isinstance(image, Image.Image):
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            # asarray wraps PIL's exported bytes without a second copy
+            return cls(np.asarray(image))
+        array = np.asarray(image)
+        if array.ndim == 3 and array.shape[2] == 4:
+            array = cv2.cvtColor(array, cv2.COLOR_RGBA2RGB)
+        return cls(array)
+
+    @property
+    def size(self):
+        """(width, height), as PIL reports it"""
+        return self.array.shape[1], self.array.shape[0]
+
+    @property
+    def is_gray(self):
+        return self.array.ndim == 2
+
+    def rgb(self):
+        """The buffer itself when it is RGB, else one converted copy"""
+        return cv2.cvtColor(self.array, cv2.COLOR_GRAY2RGB) if self.is_gray else self.array
+
+    def to_pil(self):
+        """PIL image for APIs that need one; greyscale shares the buffer, RGB is copied by PIL"""
+        if self.is_gray:
+            return Image.frombuffer('L', self.size, self.array, 'raw', 'L', 0, 1)
+        return Image.fromarray(self.array)
+
+    def save_pnm(self, path):
+        """Write uncompressed PGM/PPM straight from the buffer; no encoder pass"""
+        magic = b'P5' if self.is_gray else b'P6'
+        width, height = self.size
+        with open(path, 'wb') as f:
+            f.write(b'%s\n%d %d\n255\n' % (magic, width, height))
+            f.write(memoryview(self.array).cast('B'))
+
+
+def pixel_batch(pages, width, height, scale=1 / 255, mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)):
+    """Resize, rescale and normalize pages into one contiguous float32 N x 3 x H x W array"""
+    batch = np.empty((len(pages), 3, height, width), dtype=np.float32)
+    # (x * scale - mean) / std folded into one multiply and one subtract per channel
+    gain = (scale / np.asarray(std, dtype=np.float32)).astype(np.float32)
+    offset = (np.asarray(mean, dtype=np.float32) / np.asarray(std, dtype=np.float32)).astype(np.float32)
+    for i, page in enumerate(pages):
+        w, h = page.size
+        # Area averaging on shrink matches the anti-aliased bilinear filter PIL applies
+        interpolation = cv2.INTER_AREA if w >= width and h >= height else cv2.INTER_LINEAR
+        resized = cv2.resize(page.rgb(), (width, height), interpolation=interpolation)
+        normalized = resized.astype(np.float32)
+        normalized *= gain
+        normalized -= offset
+        batch[i] = normalized.transpose(2, 0, 1)
+    return batch
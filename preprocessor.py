@@ -2,29 +2,117 @@ import cv2
 import numpy as np
 from PIL import Image, ImageEnhance
 import logging
+import time
+from config import PREPROCESS_SETTINGS, PREPROCESS_PROFILES, PREPROCESS_STEP_COSTS, TIMEOUT_SETTINGS, TROCR_LINES
+from layout_cache import header_fingerprint
+from page_image import PageImage
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# OpenCV flags that decode at 1/2, 1/4 and 1/8 resolution (native DCT scaling for JPEG)
+REDUCED_IMREAD_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# Laplacian-of-Laplacian kernel: flat regions and straight edges cancel, pixel noise does not
+NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+# Steps that only help Tesseract; TR-OCR sees greyscale detail
+TESSERACT_ONLY_STEPS = ('sharpen', 'binarize')
+
 class ImagePreprocessor:
-    def __init__(self):
+    def __init__(self, layouts=None):
         self.min_width = 512
         self.min_height = 512
         self.max_width = 2048
         self.max_height = 2048
+        self.deskew_enabled = PREPROCESS_SETTINGS['deskew']
+        self.deskew_max_angle = PREPROCESS_SETTINGS['deskew_max_angle']
+        self.deskew_min_angle = PREPROCESS_SETTINGS['deskew_min_angle']
+        self.deskew_sample_width = PREPROCESS_SETTINGS['deskew_sample_width']
+        self.adaptive_profiles = PREPROCESS_SETTINGS['adaptive_profiles']
+        self.crop_enabled = PREPROCESS_SETTINGS['crop_to_text']
+        # ms per megapixel for each step, used to estimate the time skipped steps would have cost
+        self.step_costs = dict(PREPROCESS_STEP_COSTS)
+        # LayoutCache shared with the Tesseract stage; None disables per-layout reuse
+        self.layouts = layouts
+    
+    def load_image(self, image_path, target_size=None):
+        """Load image from path, decoding large files at reduced resolution"""
+        array = self._decode(image_path, target_size)
+        # Callers may edit the result in place; only prepare_for_ocr takes the read-only view
+        return array if array.flags.writeable else array.copy()
     
-    def load_image(self, image_path):
-        """Load image from path"""
+    def _decode(self, image_path, target_size=None):
+        """load_image without the copy; the array may be a read-only view of PIL's buffer"""
         try:
             if isinstance(image_path, str):
-                image = Image.open(image_path).convert('RGB')
+                # Image.open only parses the header, so the size is known before decoding
+                image = Image.open(image_path)
+                w, h = image.size
+                max_pixels = TIMEOUT_SETTINGS['max_pixels']
+                if max_pixels and w * h > max_pixels:
+                    raise ValueError(f"Image is {w}x{h}, over the {max_pixels} pixel limit")
+                new_size = self._target_dimensions(w, h, target_size)
+                if new_size is not None:
+                    return self._load_reduced(image_path, image, new_size)
             else:
-                image = image_path.convert('RGB')
-            return np.array(image)
+                image = image_path
+            # convert() copies even when the mode already matches, and np.array would copy again
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return np.asarray(image)
         except Exception as e:
             logger.error(f"Error loading image: {e}")
             raise
     
+    def _load_reduced(self, image_path, image, new_size):
+        """Decode at the smallest scale that still covers new_size, then downscale"""
+        w, h = image.size
+        new_w, new_h = new_size
+        factor = 1
+        for candidate in (8, 4, 2):
+            if w // candidate >= new_w and h // candidate >= new_h:
+                factor = candidate
+                break
+        
+        array = None
+        if image.format == 'JPEG':
+            # libjpeg DCT scaling: decodes straight to 1/2, 1/4 or 1/8 size
+            image.draft('RGB', (w // factor, h // factor))
+            array = np.array(image.convert('RGB'))
+        elif factor > 1 and factor in REDUCED_IMREAD_FLAGS:
+            bgr = cv2.imread(image_path, REDUCED_IMREAD_FLAGS[factor])
+            if bgr is not None:
+                array = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        
+        if array is None:
+            image = image.convert('RGB')
+            if factor > 1:
+                image = image.reduce(factor)
+            array = np.array(image)
+        
+        if array.shape[1] != new_w or array.shape[0] != new_h:
+            array = cv2.resize(array, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        
+        logger.info(f"Loaded image {w}x{h} as {new_w}x{new_h} (decode scale 1/{factor})")
+        return array
+    
+    def _target_dimensions(self, w, h, target_size=None):
+        """Return the downscaled size for an oversized image, or None if no shrink is needed"""
+        if target_size is None:
+            target_size = (1024, 1024)
+        
+        if w <= self.max_width and h <= self.max_height:
+            return None
+        
+        scale = min(target_size[0] / w, target_size[1] / h)
+        if scale >= 1:
+            return None
+        return int(w * scale), int(h * scale)
+    
     def resize_image(self, image, target_size=None):
         """Resize image while maintaining aspect ratio"""
         if target_size is None:
@@ -49,6 +137,281 @@ class ImagePreprocessor:
         logger.info(f"Resized image from {w}x{h} to {new_w}x{new_h}")
         return resized
     
+    def estimate_skew(self, image):
+        """Estimate text skew in degrees from projection profiles of a downsampled binary image"""
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if len(image.shape) == 3 else image
+        h, w = gray.shape
+        scale = min(1.0, self.deskew_sample_width / w)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        
+        ys, xs = np.nonzero(binary)
+        if len(xs) < 100:
+            return 0.0
+        # A fixed stride keeps the estimate cheap and deterministic on dense pages
+        stride = max(1, len(xs) // 20000)
+        xs = xs[::stride].astype(np.float32) - xs.mean()
+        ys = ys[::stride].astype(np.float32) - ys.mean()
+        
+        def sharpness(angle):
+            # Rows of text collapse into narrow peaks when the projection angle matches the skew
+            theta = np.deg2rad(angle)
+            projection = ys * np.cos(theta) - xs * np.sin(theta)
+            profile = np.bincount((projection - projection.min()).astype(np.int32))
+            return float(np.square(profile, dtype=np.float64).sum())
+        
+        coarse = np.arange(-self.deskew_max_angle, self.deskew_max_angle + 0.5, 1.0)
+        best = max(coarse, key=sharpness)
+        fine = np.arange(best - 1.0, best + 1.05, 0.1)
+        return float(max(fine, key=sharpness))
+    
+    def rotate_image(self, image, angle):
+        """Rotate counter-clockwise by angle degrees, enlarging the canvas to keep the corners"""
+        h, w = image.shape[:2]
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        new_w = int(h * sin + w * cos)
+        new_h = int(h * cos + w * sin)
+        matrix[0, 2] += new_w / 2 - w / 2
+        matrix[1, 2] += new_h / 2 - h / 2
+        return cv2.warpAffine(image, matrix, (new_w, new_h), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REPLICATE)
+    
+    def deskew(self, image):
+        """Straighten tilted text; returns (image, estimated angle)"""
+        angle = self.estimate_skew(image)
+        if abs(angle) < self.deskew_min_angle:
+            return image, angle
+        logger.info(f"Deskewing by {angle:.1f} degrees")
+        return self.rotate_image(image, angle), angle
+    
+    def detect_text_region(self, image):
+        """Bounding box (x0, y0, x1, y1) around all text blocks, found on a downscaled copy"""
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if len(image.shape) == 3 else image
+        h, w = gray.shape
+        scale = min(1.0, PREPROCESS_SETTINGS['crop_sample_width'] / w)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        sh, sw = gray.shape
+        
+        # Morphological gradient marks stroke edges whatever the ink and paper colours
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+        _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # A wide closing joins glyphs into words and lines, so specks stay separate from text blocks
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, sw // 40), 3)))
+        
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        min_area = PREPROCESS_SETTINGS['crop_min_block_area'] * sw * sh
+        blocks = [stats[i] for i in range(1, count) if stats[i, cv2.CC_STAT_AREA] >= min_area]
+        if not blocks:
+            return None
+        
+        x0 = min(block[cv2.CC_STAT_LEFT] for block in blocks)
+        y0 = min(block[cv2.CC_STAT_TOP] for block in blocks)
+        x1 = max(block[cv2.CC_STAT_LEFT] + block[cv2.CC_STAT_WIDTH] for block in blocks)
+        y1 = max(block[cv2.CC_STAT_TOP] + block[cv2.CC_STAT_HEIGHT] for block in blocks)
+        
+        pad = PREPROCESS_SETTINGS['crop_padding'] * min(h, w)
+        return (max(0, int(x0 / scale - pad)), max(0, int(y0 / scale - pad)),
+                min(w, int(x1 / scale + pad)), min(h, int(y1 / scale + pad)))
+    
+    def detect_text_lines(self, image):
+        """Boxes (x0, y0, x1, y1) of single text lines in reading order, found on a downscaled copy"""
+        settings = TROCR_LINES
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if len(image.shape) == 3 else image
+        h, w = gray.shape
+        scale = min(1.0, settings['sample_width'] / w)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        sh, sw = gray.shape
+        
+        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+        _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # Table rules would join every cell they touch into one block, so long strokes are removed first
+        for kernel in ((max(3, sw // settings['rule_fraction']), 1), (1, max(3, sh // settings['rule_fraction']))):
+            rules = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, kernel))
+            mask = cv2.subtract(mask, cv2.dilate(rules, np.ones((3, 3), np.uint8)))
+        # Closing horizontally only: glyphs join into lines, while tightly spaced lines stay apart
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, int(sw * settings['join_width'])), 1)))
+        
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        boxes = []
+        for x, y, bw, bh, _ in stats[1:]:
+            if settings['min_height'] <= bh <= settings['max_height'] * sh and bw >= bh * settings['min_aspect']:
+                pad = bh * settings['padding']
+                boxes.append((max(0, int((x - pad) / scale)), max(0, int((y - pad) / scale)),
+                              min(w, int((x + bw + pad) / scale)), min(h, int((y + bh + pad) / scale))))
+        
+        # Reading order: rows of boxes whose vertical centres fall within the row's first box, left to right
+        boxes.sort(key=lambda box: (box[1] + box[3]) / 2)
+        rows = []
+        for box in boxes:
+            if rows and (box[1] + box[3]) / 2 < rows[-1][0][3]:
+                rows[-1].append(box)
+            else:
+                rows.append([box])
+        return [box for row in rows for box in sorted(row)]
+    
+    def crop_to_text(self, image):
+        """Crop blank margins and background; returns (image, fraction of pixels kept)"""
+        box = self.detect_text_region(image)
+        if box is None:
+            return image, 1.0
+        x0, y0, x1, y1 = box
+        h, w = image.shape[:2]
+        kept = (x1 - x0) * (y1 - y0) / (w * h)
+        if kept > 1 - PREPROCESS_SETTINGS['crop_min_saving']:
+            return image, 1.0
+        logger.info(f"Cropped {w}x{h} to text region {x1 - x0}x{y1 - y0} ({kept:.0%} of pixels kept)")
+        # A view is enough; later steps allocate their own outputs
+        return image[y0:y1, x0:x1], kept
+    
+    def prepare_for_ocr(self, image_path):
+        """Load and straighten an image once for every engine; returns (PageImage, stage timings)"""
+        timings = {}
+        start = time.perf_counter()
+        # OCR resolution: originals up to max_width x max_height are kept as they are; larger ones
+        # are shrunk to fit it, not to load_image's 1024 x 1024 default. The uncopied, possibly
+        # read-only array is enough here: every later step allocates its own output
+        image = self._decode(image_path, target_size=(self.max_width, self.max_height))
+        timings['load'] = time.perf_counter() - start
+        resolution = self.page_resolution(image_path, image)
+        
+        if self.deskew_enabled:
+            start = time.perf_counter()
+            image, angle = self.deskew(image)
+            timings['deskew'] = time.perf_counter() - start
+            timings['skew_angle'] = angle
+        
+        # Cropping before the profile steps means denoising and OCR only see text-bearing pixels
+        if self.crop_enabled:
+            start = time.perf_counter()
+            image, kept = self.crop_to_text(image)
+            timings['crop'] = time.perf_counter() - start
+            timings['crop_fraction'] = round(kept, 3)
+        
+        # Invoices from one supplier share a header; reuse the profile and config learned for it
+        profile = None
+        if self.layouts is not None:
+            start = time.perf_counter()
+            timings['layout'] = header_fingerprint(image)
+            entry = self.layouts.lookup(timings['layout'])
+            if self.layouts.is_learned(entry):
+                timings['layout_config'] = entry['config']
+                profile = entry['profile']
+            timings['fingerprint'] = time.perf_counter() - start
+        
+        # The engines read the image untouched before profiles existed, so running steps here is
+        # opt-in; shared by every engine, so Tesseract-only steps are left to Tesseract
+        if PREPROCESS_SETTINGS['preprocess_engine_input']:
+            image, profile_timings = self.apply_profile(image, resolution, for_tesseract=False, profile=profile,
+                                                        baseline=())
+            timings.update(profile_timings)
+        
+        # Engines read views of this one buffer instead of converting to PIL each
+        return PageImage(image), timings
+    
+    def page_resolution(self, image_path, image):
+        """(DPI scaled to the decoded size or None, decoded page height), taken before any cropping"""
+        source = Image.open(image_path) if isinstance(image_path, str) else image_path
+        dpi = source.info.get('dpi')
+        if not dpi or not dpi[0]:
+            return None, image.shape[0]
+        return float(dpi[0]) * image.shape[1] / source.size[0], image.shape[0]
+    
+    def image_stats(self, image, dpi=None):
+        """Cheap statistics used to pick a preprocessing profile"""
+        h, w = image.shape[:2]
+        
+        # Noise from a full-resolution centre crop; the median ignores the sparse text edges
+        y0, x0 = max(0, h // 2 - 256), max(0, w // 2 - 256)
+        crop = image[y0:y0 + 512, x0:x0 + 512]
+        if len(crop.shape) == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+        response = cv2.filter2D(crop.astype(np.float32), -1, NOISE_KERNEL)[1:-1, 1:-1]
+        noise = float(np.median(np.abs(response))) / (0.6745 * 6)
+        
+        scale = min(1.0, 512 / max(h, w))
+        small = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        if len(small.shape) == 3:
+            color = float(small.astype(np.float32).std(axis=2).mean())
+            gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        else:
+            color = 0.0
+            gray = small
+        
+        # Contrast is the gap between mean ink and mean paper on either side of Otsu's threshold
+        _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        paper, ink = gray[mask > 0], gray[mask == 0]
+        contrast = float(paper.mean() - ink.mean()) if paper.size and ink.size else 0.0
+        
+        return {
+            'noise': round(noise, 2),
+            'contrast': round(contrast, 1),
+            'color': round(color, 1),
+            'dpi': round(dpi) if dpi else None,
+            'megapixels': round(h * w / 1e6, 2)
+        }
+    
+    def choose_profile(self, stats, height):
+        """Map image statistics to a PREPROCESS_PROFILES entry"""
+        if not self.adaptive_profiles:
+            return 'full'
+        if stats['color'] >= PREPROCESS_SETTINGS['color_threshold']:
+            return 'photo'
+        if stats['noise'] >= PREPROCESS_SETTINGS['noise_threshold']:
+            return 'noisy'
+        if stats['dpi'] is not None:
+            low_resolution = stats['dpi'] < PREPROCESS_SETTINGS['low_dpi']
+        else:
+            low_resolution = height < PREPROCESS_SETTINGS['low_resolution_height']
+        if low_resolution:
+            return 'low_resolution'
+        if stats['contrast'] < PREPROCESS_SETTINGS['contrast_threshold']:
+            return 'low_contrast'
+        return 'clean'
+    
+    def apply_profile(self, image, resolution, for_tesseract=True, profile=None, baseline=None):
+        """Run the given or chosen profile; preprocess_saved is what it skipped of baseline (default: full recipe)"""
+        start = time.perf_counter()
+        if profile in PREPROCESS_PROFILES:
+            stats = 'from layout cache'
+        else:
+            dpi, page_height = resolution
+            stats = self.image_stats(image, dpi)
+            profile = self.choose_profile(stats, page_height)
+        timings = {'profile': profile, 'profile_stats': time.perf_counter() - start}
+        
+        steps = {
+            'contrast': self.enhance_contrast,
+            'denoise': self.remove_noise,
+            'sharpen': self.sharpen_image,
+            'binarize': lambda img: self.binarize_image(img, method='adaptive')
+        }
+        excluded = () if for_tesseract else TESSERACT_ONLY_STEPS
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+        
+        start = time.perf_counter()
+        for step in PREPROCESS_PROFILES[profile]:
+            if step in excluded:
+                continue
+            step_start = time.perf_counter()
+            image = steps[step](image)
+            if megapixels:
+                measured = (time.perf_counter() - step_start) * 1000 / megapixels
+                self.step_costs[step] = 0.8 * self.step_costs[step] + 0.2 * measured
+        timings['preprocess'] = time.perf_counter() - start
+        
+        baseline = PREPROCESS_PROFILES['full'] if baseline is None else baseline
+        skipped = [step for step in baseline
+                   if step not in PREPROCESS_PROFILES[profile] and step not in excluded]
+        timings['preprocess_saved'] = sum(self.step_costs[step] for step in skipped) * megapixels / 1000
+        logger.info(f"Preprocessing profile '{profile}' {stats}: {timings['preprocess'] * 1000:.0f} ms, "
+                    f"skipped {skipped or 'nothing'} of the baseline, ~{timings['preprocess_saved'] * 1000:.0f} ms saved")
+        return image, timings
+    
     def enhance_contrast(self, image):
         """Enhance image contrast using CLAHE"""
         if len(image.shape) == 3:
@@ -95,35 +458,41 @@ class ImagePreprocessor:
     def preprocess_for_tesseract(self, image_path):
         """Preprocessing optimized for Tesseract"""
         image = self.load_image(image_path)
+        resolution = self.page_resolution(image_path, image)
         
-        # Resize if needed
-        image = self.resize_image(image)
-        
-        # Enhance contrast
-        image = self.enhance_contrast(image)
+        # Straighten tilted text
+        if self.deskew_enabled:
+            image, _ = self.deskew(image)
         
-        # Remove noise
-        image = self.remove_noise(image)
+        # Drop blank margins and background
+        if self.crop_enabled:
+            image, _ = self.crop_to_text(image)
         
-        # Sharpen
-        image = self.sharpen_image(image)
+        # Resize if needed
+        image = self.resize_image(image)
         
-        # Convert to binary
-        binary_image = self.binarize_image(image, method='adaptive')
+        # Contrast, denoise, sharpen and binarize as this image's profile needs
+        image, _ = self.apply_profile(image, resolution)
         
-        return Image.fromarray(binary_image)
+        return Image.fromarray(image)
     
     def preprocess_for_trocr(self, image_path):
         """Preprocessing optimized for TR-OCR"""
         image = self.load_image(image_path)
+        resolution = self.page_resolution(image_path, image)
+        
+        # Straighten tilted text
+        if self.deskew_enabled:
+            image, _ = self.deskew(image)
+        
+        # Drop blank margins and background
+        if self.crop_enabled:
+            image, _ = self.crop_to_text(image)
         
         # Resize if needed
         image = self.resize_image(image)
         
-        # Enhance contrast
-        image = self.enhance_contrast(image)
-        
-        # Remove noise
-        image = self.remove_noise(image)
+        # Contrast and denoise as this image's profile needs
+        image, _ = self.apply_profile(image, resolution, for_tesseract=False)
         
         return Image.fromarray(image)
\ No newline at end of file
@@ -0,0 +1,175 @@
+import os
+import time
+import logging
+import multiprocessing
+from config import RESOURCE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_current = None
+
+
+def available_cpus():
+    """CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ResourceManager:
+    def __init__(self, core_budget=None, workers=None, pin_cpus=None):
+        cpus = available_cpus()
+        if core_budget is None:
+            core_budget = RESOURCE_SETTINGS['core_budget'] or len(cpus)
+        if workers is None:
+            workers = RESOURCE_SETTINGS['workers']
+        if pin_cpus is None:
+            pin_cpus = RESOURCE_SETTINGS['pin_cpus']
+        
+        self.cpus = cpus[:core_budget]
+        self.core_budget = len(self.cpus)
+        self.workers = max(1, min(workers, self.core_budget))
+        self.pin_cpus = pin_cpus
+        # Tesseract and TrOCR run one after the other inside a worker, so both get the worker's full share
+        self.threads_per_worker = max(1, self.core_budget // self.workers)
+        self.worker_index = None
+    
+    def plan(self):
+        """Describe the thread split"""
+        return {
+            'core_budget': self.core_budget,
+            'workers': self.workers,
+            'torch_threads': self.threads_per_worker,
+            'tesseract_threads': self.threads_per_worker,
+            'pin_cpus': self.pin_cpus
+        }
+    
+    def worker_cpus(self, worker_index):
+        """Slice of the core budget owned by one worker"""
+        start = (worker_index % self.workers) * self.threads_per_worker
+        return self.cpus[start:start + self.threads_per_worker]
+    
+    def apply_torch(self):
+        """Limit PyTorch intra-op and inter-op threads"""
+        import torch
+        torch.set_num_threads(self.threads_per_worker)
+        try:
+            torch.set_num_interop_threads(RESOURCE_SETTINGS['interop_threads'])
+        except RuntimeError:
+            # Only settable before the first parallel operation in the process
+            pass
+    
+    def apply_tesseract(self):
+        """Limit Tesseract's OpenMP threads (read by every tesseract subprocess)"""
+        os.environ['OMP_THREAD_LIMIT'] = str(self.threads_per_worker)
+    
+    def apply_pipeline(self, tesseract_workers=None):
+        """Split a worker's threads between concurrent Tesseract subprocesses and TR-OCR"""
+        import torch
+        if tesseract_workers is None:
+            tesseract_workers = max(1, self.threads_per_worker // 2)
+        # Many single-threaded tesseract processes outrun one process using OpenMP
+        os.environ['OMP_THREAD_LIMIT'] = '1'
+        torch.set_num_threads(max(1, self.threads_per_worker - tesseract_workers))
+        return tesseract_workers
+    
+    def apply(self, worker_index=None):
+        """Apply the plan to the current process, optionally pinning it as a worker"""
+        self.worker_index = worker_index
+        self.apply_tesseract()
+        self.apply_torch()
+        
+        if self.pin_cpus and worker_index is not None:
+            cpus = self.worker_cpus(worker_index)
+            if hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpus)
+                logger.info(f"Worker {worker_index} pinned to CPUs {cpus}")
+            else:
+                logger.warning("CPU pinning is not supported on this platform")
+        
+        logger.info(f"Resource plan: {self.plan()}")
+
+
+def get_resource_manager():
+    """Process-wide resource manager, created from config on first use"""
+    global _current
+    if _current is None:
+        _current = ResourceManager()
+    return _current
+
+
+def set_resource_manager(manager):
+    """Replace the process-wide resource manager"""
+    global _current
+    _current = manager
+    return manager
+
+
+def _sweep_task(image_path):
+    import batch_processor
+    start = time.time()
+    batch_processor._worker_extractor.extract_text_hybrid(image_path)
+    return start, time.time()
+
+
+def sweep(image_files, core_budget=None, worker_counts=None, pin_cpus=None, repeat=1):
+    """Measure images/sec for each worker count and return the fastest plan"""
+    from batch_processor import _init_worker
+    
+    core_budget = ResourceManager(core_budget).core_budget
+    if worker_counts is None:
+        worker_counts = [w for w in (1, 2, 3, 4, 6, 8, 12, 16) if w <= core_budget]
+    
+    tasks = list(image_files) * repeat
+    print(f"RESOURCE SWEEP ({len(tasks)} images, {core_budget} cores)")
+    print("=" * 60)
+    print(f"{'Workers':>8} {'Threads':>8} {'Images/sec':>12} {'Seconds':>10}")
+    print("-" * 60)
+    
+    timings = []
+    for workers in worker_counts:
+        manager = ResourceManager(core_budget, workers, pin_cpus)
+        counter = multiprocessing.Value('i', 0)
+        with multiprocessing.Pool(manager.workers, initializer=_init_worker,
+                                  initargs=(core_budget, workers, pin_cpus, counter)) as pool:
+            spans = pool.map(_sweep_task, tasks, chunksize=1)
+        
+        # Measured from the first image started to the last finished, so model loading is excluded
+        elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+        throughput = len(tasks) / elapsed if elapsed > 0 else 0.0
+        timings.append((throughput, manager.plan()))
+        print(f"{manager.workers:>8} {manager.threads_per_worker:>8} {throughput:>12.3f} {elapsed:>10.1f}")
+    
+    best_throughput, best_plan = max(timings, key=lambda t: t[0])
+    print("-" * 60)
+    print(f"Best: {best_plan['workers']} workers x {best_plan['torch_threads']} threads "
+          f"({best_throughput:.3f} images/sec)")
+    return best_plan
+
+
+if __name__ == "__main__":
+    import argparse
+    from telemetry import setup_logging
+    
+    setup_logging()
+    
+    parser = argparse.ArgumentParser(description="CPU budget planner for Tesseract + TR-OCR workloads")
+    parser.add_argument("input_folder", help="Folder of sample images for --sweep", nargs='?', default="invoice_image")
+    parser.add_argument("--cores", type=int, help="Core budget (default: all available)")
+    parser.add_argument("--workers", type=int, help="Worker processes")
+    parser.add_argument("--pin", action="store_true", help="Pin workers to CPU slices")
+    parser.add_argument("--sweep", action="store_true", help="Measure throughput for each worker count")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each image is processed during --sweep")
+    
+    args = parser.parse_args()
+    
+    if args.sweep:
+        image_extensions = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff')
+        image_files = sorted(
+            os.path.join(args.input_folder, f) for f in os.listdir(args.input_folder)
+            if f.lower().endswith(image_extensions)
+        )
+        worker_counts = [args.workers] if args.workers else None
+        sweep(image_files, args.cores, worker_counts, args.pin or None, args.repeat)
+    else:
+        print(ResourceManager(args.cores, args.workers, args.pin or None).plan())
@@ -0,0 +1,380 @@
+import os
+import json
+import ntpath
+import sqlite3
+import logging
+from datetime import datetime
+from text_index import TextIndex
+from telemetry import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    file_path TEXT UNIQUE NOT NULL,
+    file_name TEXT NOT NULL,
+    method TEXT,
+    confidence REAL,
+    text_length INTEGER,
+    processed_at TEXT,
+    best_text TEXT,
+    error TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_file_name ON results(file_name);
+CREATE INDEX IF NOT EXISTS idx_results_method ON results(method);
+CREATE INDEX IF NOT EXISTS idx_results_confidence ON results(confidence);
+CREATE INDEX IF NOT EXISTS idx_results_processed_at ON results(processed_at);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5(
+    best_text, content='results', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS results_fts_insert AFTER INSERT ON results BEGIN
+    INSERT INTO results_fts(rowid, best_text) VALUES (new.id, new.best_text);
+END;
+CREATE TRIGGER IF NOT EXISTS results_fts_delete AFTER DELETE ON results BEGIN
+    INSERT INTO results_fts(results_fts, rowid, best_text) VALUES ('delete', old.id, old.best_text);
+END;
+CREATE TRIGGER IF NOT EXISTS results_fts_update AFTER UPDATE ON results BEGIN
+    INSERT INTO results_fts(results_fts, rowid, best_text) VALUES ('delete', old.id, old.best_text);
+    INSERT INTO results_fts(rowid, best_text) VALUES (new.id, new.best_text);
+END;
+
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY,
+    processing_date TEXT,
+    input_folder TEXT,
+    total_images INTEGER,
+    successful INTEGER,
+    failed INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS ingest_state (
+    file_path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS quarantine (
+    file_path TEXT PRIMARY KEY,
+    reason TEXT,
+    quarantined_at TEXT,
+    mtime REAL,
+    size INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def file_signature(file_path):
+    """(mtime, size) of a file, as compared to detect a changed copy"""
+    stat = os.stat(file_path)
+    return stat.st_mtime, stat.st_size
+
+
+def store_path_for(results_file):
+    """Database file that backs a results JSON file"""
+    return os.path.splitext(results_file)[0] + '.db'
+
+
+class ResultsStore:
+    def __init__(self, db_path, shared=False):
+        self.db_path = db_path
+        # Distributed workers share one store, so wait for the write lock rather than erroring
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        # WAL's shared-memory index only works between processes on one host. A store that
+        # several hosts open over a network filesystem keeps the rollback journal, including
+        # when it is later opened locally (e.g. by view_results.py) while workers still write
+        if shared:
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(SCHEMA)
+        if 'mtime' not in {row['name'] for row in self.conn.execute("PRAGMA table_info(quarantine)")}:
+            # Stores from before quarantine entries carried the file signature
+            with self.conn:
+                self.conn.execute("ALTER TABLE quarantine ADD COLUMN mtime REAL")
+                self.conn.execute("ALTER TABLE quarantine ADD COLUMN size INTEGER")
+        if shared:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('shared', '1')")
+        elif self.conn.execute("SELECT 1 FROM store_meta WHERE key = 'shared'").fetchone() is None:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.text_index = TextIndex(self.conn)
+        if self._text_index_missing():
+            self.rebuild_text_index()
+
+    def _text_index_missing(self):
+        """Stores created before the text index existed have results but no indexed text"""
+        has_results = self.conn.execute("SELECT EXISTS (SELECT 1 FROM results)").fetchone()[0]
+        has_index = self.conn.execute("SELECT EXISTS (SELECT 1 FROM text_index_docs)").fetchone()[0]
+        return has_results and not has_index
+
+    def rebuild_text_index(self):
+        with self.conn:
+            self.text_index.clear()
+            for row in self.conn.execute("SELECT file_path, record FROM results").fetchall():
+                self.text_index.add(row['file_path'], json.loads(row['record']))
+        logger.info(f"Rebuilt text index in {self.db_path}")
+
+    def close(self):
+        self.conn.close()
+
+    def add_result(self, file_path, result, commit=True):
+        """Insert or replace the record for one image"""
+        best_result = result.get('best_result', {})
+        text = best_result.get('text', '')
+        self.conn.execute(
+            """
+            INSERT INTO results (file_path, file_name, method, confidence, text_length,
+                                 processed_at, best_text, error, record)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                file_name = excluded.file_name, method = excluded.method,
+                confidence = excluded.confidence, text_length = excluded.text_length,
+                processed_at = excluded.processed_at, best_text = excluded.best_text,
+                error = excluded.error, record = excluded.record
+            """,
+            (
+                file_path,
+                # Paths may come from Windows runs, so split on either separator
+                ntpath.basename(file_path),
+                best_result.get('method'),
+                best_result.get('confidence', 0),
+                len(text),
+                result.get('timestamp', datetime.now().isoformat()),
+                text,
+                result.get('error'),
+                json.dumps(result, ensure_ascii=False)
+            )
+        )
+        self.text_index.add(file_path, result)
+        if commit:
+            self.conn.commit()
+
+    def add_batch(self, metadata):
+        """Record the summary of one batch run"""
+        self.conn.execute(
+            "INSERT INTO batches (processing_date, input_folder, total_images, successful, failed) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (metadata.get('processing_date'), metadata.get('input_folder'),
+             metadata.get('total_images', 0), metadata.get('successful', 0), metadata.get('failed', 0))
+        )
+        self.conn.commit()
+
+    def latest_batch(self):
+        row = self.conn.execute("SELECT * FROM batches ORDER BY id DESC LIMIT 1").fetchone()
+        return dict(row) if row else {}
+
+    def ingest_state(self):
+        """File signatures (mtime, size) as of their last ingestion"""
+        return {row['file_path']: (row['mtime'], row['size'])
+                for row in self.conn.execute("SELECT * FROM ingest_state")}
+
+    def mark_ingested(self, file_path, signature):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ingest_state (file_path, mtime, size) VALUES (?, ?, ?)",
+            (file_path, signature[0], signature[1])
+        )
+        self.conn.commit()
+
+    def quarantine(self, file_path, reason):
+        """Record an input that timed out or crashed so later runs skip it until it changes"""
+        mtime, size = file_signature(file_path) if os.path.exists(file_path) else (None, None)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO quarantine (file_path, reason, quarantined_at, mtime, size) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (file_path, reason, datetime.now().isoformat(), mtime, size)
+        )
+        self.conn.commit()
+
+    def quarantined(self):
+        return {row['file_path']: row['reason'] for row in self.conn.execute("SELECT * FROM quarantine")}
+
+    def release_changed(self, signatures):
+        """Release quarantined inputs whose (mtime, size) differs from the quarantined copy's; returns them"""
+        released = [row['file_path'] for row in self.conn.execute("SELECT * FROM quarantine")
+                    if row['file_path'] in signatures and row['mtime'] is not None
+                    and signatures[row['file_path']] != (row['mtime'], row['size'])]
+        if released:
+            self.conn.executemany("DELETE FROM quarantine WHERE file_path = ?", [(path,) for path in released])
+            self.conn.commit()
+        return released
+
+    def release(self, file_path=None):
+        """Let quarantined inputs be processed again (all of them when file_path is None)"""
+        if file_path is None:
+            self.conn.execute("DELETE FROM quarantine")
+        else:
+            self.conn.execute("DELETE FROM quarantine WHERE file_path = ?", (file_path,))
+        self.conn.commit()
+
+    def mark_source(self, json_path):
+        """Remember which JSON file (and version) this store mirrors"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('source_mtime', ?)",
+            (str(os.path.getmtime(json_path)),)
+        )
+        self.conn.commit()
+
+    def mark_authoritative(self):
+        """Results are written here directly (watch mode, queue workers), never only to a JSON file"""
+        self.conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('authoritative', '1')")
+        self.conn.commit()
+
+    def is_current(self, json_path):
+        # A results JSON beside an authoritative store is at best a subset of it; importing would wipe rows
+        if self.conn.execute("SELECT 1 FROM store_meta WHERE key = 'authoritative'").fetchone() is not None:
+            return True
+        row = self.conn.execute("SELECT value FROM store_meta WHERE key = 'source_mtime'").fetchone()
+        return row is not None and float(row['value']) >= os.path.getmtime(json_path)
+
+    def import_json(self, json_path):
+        """Replace the store contents with a batch results JSON file"""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        with self.conn:
+            self.conn.execute("DELETE FROM results")
+            self.conn.execute("DELETE FROM batches")
+            self.text_index.clear()
+        for file_path, result in data.get('results', {}).items():
+            self.add_result(file_path, result, commit=False)
+        self.add_batch(data.get('metadata', {}))
+        self.mark_source(json_path)
+        logger.info(f"Imported {len(data.get('results', {}))} results from {json_path} into {self.db_path}")
+
+    def iter_results(self, file=None, method=None, min_confidence=None, since=None, limit=None):
+        """Yield result rows matching the filters, streaming from the database"""
+        if file:
+            # Exact names use the file_name index; the substring scan only runs when nothing matches
+            found = False
+            for row in self._query("file_name = ?", file, method, min_confidence, since, limit):
+                found = True
+                yield row
+            if not found:
+                yield from self._query("file_name LIKE ?", f"%{file}%", method, min_confidence, since, limit)
+        else:
+            yield from self._query(None, None, method, min_confidence, since, limit)
+
+    def _query(self, file_clause, file_param, method, min_confidence, since, limit):
+        clauses = []
+        params = []
+        if file_clause:
+            clauses.append(file_clause)
+            params.append(file_param)
+        if method:
+            clauses.append("method = ?")
+            params.append(method)
+        if min_confidence is not None:
+            clauses.append("confidence >= ?")
+            params.append(min_confidence)
+        if since:
+            clauses.append("processed_at >= ?")
+            params.append(since)
+
+        query = "SELECT * FROM results"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY file_path"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return self.conn.execute(query, params)
+
+    def search(self, query, limit=20):
+        """Full-text search over the best extracted text"""
+        # Quote the query so punctuation in invoice numbers is not parsed as FTS syntax
+        fts_query = '"' + query.replace('"', '""') + '"'
+        return self.conn.execute(
+            "SELECT results.*, snippet(results_fts, 0, '[', ']', '...', 12) AS snippet "
+            "FROM results_fts JOIN results ON results.id = results_fts.rowid "
+            "WHERE results_fts MATCH ? ORDER BY rank LIMIT ?",
+            (fts_query, limit)
+        ).fetchall()
+
+    def summary(self):
+        """Aggregate statistics over results that contain text"""
+        row = self.conn.execute(
+            "SELECT COUNT(*) AS total, "
+            "SUM(text_length > 0) AS with_text, "
+            "AVG(CASE WHEN text_length > 0 THEN text_length END) AS avg_chars, "
+            "AVG(CASE WHEN text_length > 0 THEN confidence END) AS avg_confidence, "
+            "SUM(text_length) AS total_chars "
+            "FROM results"
+        ).fetchone()
+        return {key: row[key] or 0 for key in row.keys()}
+
+
+def record(row):
+    """Full result dict stored for a row"""
+    return json.loads(row['record'])
+
+
+def open_results(results_file):
+    """Open the store for a results file, importing JSON when the store is missing or stale"""
+    if results_file.endswith('.db'):
+        return ResultsStore(results_file)
+
+    store = ResultsStore(store_path_for(results_file))
+    if not store.is_current(results_file):
+        store.import_json(results_file)
+    return store
+
+
+def main():
+    import argparse
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Query the indexed invoice results store")
+    parser.add_argument("results_file", help="Results .db file, or results JSON to import", default="batch_results.json", nargs='?')
+    parser.add_argument("--file", "-f", help="File name (exact or substring)")
+    parser.add_argument("--method", "-m", help="Best-result method, e.g. tesseract_auto")
+    parser.add_argument("--min-confidence", type=float, help="Minimum best-result confidence")
+    parser.add_argument("--since", help="Processed on or after this ISO date")
+    parser.add_argument("--search", "-s", help="Full-text search over extracted text")
+    parser.add_argument("--limit", "-n", type=int, default=50)
+    parser.add_argument("--quarantined", action="store_true", help="List inputs that timed out or crashed")
+    parser.add_argument("--release", action="store_true", help="Clear the quarantine so those inputs are retried")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.results_file):
+        print(f"Error: Results file '{args.results_file}' not found")
+        return
+
+    store = open_results(args.results_file)
+
+    if args.release:
+        store.release()
+        print("Quarantine cleared")
+    elif args.quarantined:
+        quarantined = store.quarantined()
+        for file_path, reason in sorted(quarantined.items()):
+            print(f"{ntpath.basename(file_path):<30} {reason}")
+        print(f"\n{len(quarantined)} quarantined")
+    elif args.search:
+        rows = store.search(args.search, args.limit)
+        for row in rows:
+            snippet = row['snippet'].replace('\n', ' ')
+            print(f"{row['file_name']:<30} {row['method'] or 'N/A':<20} {row['confidence'] or 0:.3f}  {snippet}")
+        print(f"\n{len(rows)} match(es)")
+    else:
+        count = 0
+        for row in store.iter_results(args.file, args.method, args.min_confidence, args.since, args.limit):
+            count += 1
+            print(f"{row['file_name']:<30} {row['method'] or 'N/A':<20} {row['confidence'] or 0:.3f} "
+                  f"{row['text_length']:>6} chars  {row['processed_at']}")
+        print(f"\n{count} result(s)")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
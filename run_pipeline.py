@@ -2,8 +2,11 @@ import argparse
 import os
 import sys
 from hybrid_extractor import HybridInvoiceExtractor
+from telemetry import setup_logging
 
 def main():
+    setup_logging()
+    
     parser = argparse.ArgumentParser(description="Invoice Text Extraction Pipeline")
     parser.add_argument("input_path", help="Path to input image or folder")
     parser.add_argument("--output", "-o", help="Output JSON file", default="extraction_results.json")
@@ -0,0 +1,155 @@
+import time
+import queue
+import logging
+import threading
+import telemetry
+from config import PIPELINE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class StagedPipeline:
+    """Decode, Tesseract and TR-OCR stages connected by bounded queues.
+
+    Image N+1 is decoded while image N is in Tesseract and image N-1 is in TR-OCR.
+    Results are yielded as (image_path, result, error) in completion order.
+    """
+
+    def __init__(self, extractor, resources, settings=None):
+        self.extractor = extractor
+        self.settings = dict(PIPELINE_SETTINGS, **(settings or {}))
+        self.tesseract_workers = resources.apply_pipeline(self.settings['tesseract_workers'])
+
+        # Each stage reads from its own input queue; bounded queues apply backpressure upstream
+        self.decode_queue = queue.Queue()
+        self.tesseract_queue = queue.Queue(self.settings['tesseract_queue_depth'])
+        self.trocr_queue = queue.Queue(self.settings['trocr_queue_depth'])
+        self.output_queue = queue.Queue()
+
+    def queue_depths(self):
+        """Current number of items waiting in front of each stage"""
+        return {
+            'decode': self.decode_queue.qsize(),
+            'tesseract': self.tesseract_queue.qsize(),
+            'trocr': self.trocr_queue.qsize()
+        }
+
+    def _decode_stage(self):
+        while True:
+            image_path = self.decode_queue.get()
+            if image_path is _STOP:
+                return
+            try:
+                image, timings = self.extractor.preprocessor.prepare_for_ocr(image_path)
+                self.tesseract_queue.put((image_path, image, timings))
+            except Exception as e:
+                self.output_queue.put((image_path, None, f"Decode failed: {e}"))
+
+    def _tesseract_stage(self):
+        while True:
+            item = self.tesseract_queue.get()
+            if item is _STOP:
+                return
+            image_path, image, timings = item
+            try:
+                # Each call runs tesseract subprocesses, so threads here overlap real work
+                start = time.perf_counter()
+                tesseract_results = self.extractor.run_tesseract(image, timings)
+                timings['tesseract'] = time.perf_counter() - start
+                self.trocr_queue.put((image_path, image, tesseract_results, timings))
+            except Exception as e:
+                self.output_queue.put((image_path, None, f"Tesseract failed: {e}"))
+
+    def _next_trocr_batch(self):
+        """Block for one item, then gather more until the batch is full or the timeout passes"""
+        batch = [self.trocr_queue.get()]
+        while batch[-1] is not _STOP and len(batch) < self.settings['trocr_batch_size']:
+            try:
+                batch.append(self.trocr_queue.get(timeout=self.settings['trocr_batch_timeout']))
+            except queue.Empty:
+                break
+        return batch
+
+    def _trocr_stage(self):
+        while True:
+            batch = self._next_trocr_batch()
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+
+            if batch:
+                images = [image for _, image, _, _ in batch]
+                try:
+                    lines = [self.extractor.text_lines(image, timings) for _, image, _, timings in batch]
+                    # Batched calls are timed as a whole and attributed evenly to their images
+                    start = time.perf_counter()
+                    printed = self.extractor.trocr_printed.extract_lines_batch(images, lines)
+                    printed_seconds = (time.perf_counter() - start) / len(batch)
+                    start = time.perf_counter()
+                    handwritten = self.extractor.trocr_handwritten.extract_lines_batch(images, lines)
+                    handwritten_seconds = (time.perf_counter() - start) / len(batch)
+                except Exception as e:
+                    logger.error(f"TR-OCR batch failed: {e}")
+                    printed = handwritten = [{'text': '', 'confidence': 0.0}] * len(batch)
+                    printed_seconds = handwritten_seconds = 0.0
+
+                for (image_path, _, tesseract_results, timings), printed_result, handwritten_result in zip(
+                        batch, printed, handwritten):
+                    results = {
+                        'tesseract': tesseract_results,
+                        'trocr_printed': printed_result,
+                        'trocr_handwritten': handwritten_result
+                    }
+                    timings['trocr_printed'] = printed_seconds
+                    timings['trocr_handwritten'] = handwritten_seconds
+                    output = self.extractor.build_output(image_path, self.extractor.combine_results(results, timings))
+                    self.output_queue.put((image_path, output, None))
+
+            if stopping:
+                self.output_queue.put(_STOP)
+                return
+
+    def _start(self, target, count):
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _feed_and_close(self, image_files):
+        """Feed paths, then shut stages down in order as each one drains"""
+        decode_threads = self._start(self._decode_stage, self.settings['decode_workers'])
+        tesseract_threads = self._start(self._tesseract_stage, self.tesseract_workers)
+        self._start(self._trocr_stage, 1)
+
+        for image_path in image_files:
+            self.decode_queue.put(image_path)
+
+        for _ in decode_threads:
+            self.decode_queue.put(_STOP)
+        for thread in decode_threads:
+            thread.join()
+
+        for _ in tesseract_threads:
+            self.tesseract_queue.put(_STOP)
+        for thread in tesseract_threads:
+            thread.join()
+
+        self.trocr_queue.put(_STOP)
+
+    def run(self, image_files):
+        """Process image_files through all stages, yielding results as they complete"""
+        logger.info(f"Pipeline: {self.settings['decode_workers']} decode, "
+                    f"{self.tesseract_workers} Tesseract, TR-OCR batch {self.settings['trocr_batch_size']}")
+        threading.Thread(target=self._feed_and_close, args=(list(image_files),), daemon=True).start()
+
+        while True:
+            item = self.output_queue.get()
+            if item is _STOP:
+                return
+            depths = self.queue_depths()
+            for name, depth in depths.items():
+                telemetry.QUEUE_DEPTH.set(depth, queue=name)
+            logger.debug(f"Queue depths: {depths}")
+            yield item
@@ -0,0 +1,241 @@
+import os
+import glob
+import random
+import logging
+import argparse
+import multiprocessing
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from config import SYNTHETIC_SETTINGS
+from telemetry import setup_logging
+
+logger = logging.getLogger(__name__)
+
+FONT_DIRS = [
+    '/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.fonts'),
+    '/Library/Fonts', '/System/Library/Fonts', os.path.expanduser('~/Library/Fonts'),
+    r'C:\Windows\Fonts'
+]
+HANDWRITING_HINTS = ('hand', 'script', 'comic', 'segoepr', 'segoesc', 'brush', 'marker', 'caveat', 'kalam', 'indie')
+
+SUPPLIERS = ['Refrens Business', 'S.K.P.S Digital', 'Arbucks Private Ltd', 'Sharma Traders', 'Blue Ocean Exports',
+             'Green Leaf Stores', 'Metro Hardware', 'Sunrise Textiles', 'Apex Electronics', 'City Medicals']
+CUSTOMERS = ['ABC XYZ Business', 'Nazim Khan', 'Priya Stationers', 'Orbit Logistics', 'Kumar & Sons',
+             'Delta Foods', 'Vertex Labs', 'Harbor Cafe']
+CITIES = ['Noida', 'New Delhi', 'Bengaluru', 'Chennai', 'Mumbai', 'Pune', 'Hyderabad', 'Kolkata']
+ITEMS = ['Printer Paper A4', 'Ink Cartridge', 'USB Cable', 'Office Chair', 'LED Bulb', 'Notebook',
+         'Cotton Fabric', 'Steel Bolts', 'Coffee Beans', 'Hand Sanitizer', 'Wireless Mouse', 'Packing Tape',
+         'Consulting Hours', 'Delivery Charges', 'Software License', 'Water Bottles']
+
+_font_cache = {}
+
+
+def find_fonts():
+    """TrueType fonts on this machine, split into (printed, handwriting-like)"""
+    if 'fonts' not in _font_cache:
+        printed, handwriting = [], []
+        for font_dir in FONT_DIRS:
+            for path in glob.glob(os.path.join(font_dir, '**', '*.[ot]tf'), recursive=True):
+                name = os.path.basename(path).lower()
+                if any(hint in name for hint in HANDWRITING_HINTS):
+                    handwriting.append(path)
+                elif 'bold' not in name and 'italic' not in name and 'oblique' not in name:
+                    printed.append(path)
+        _font_cache['fonts'] = (sorted(printed), sorted(handwriting))
+    return _font_cache['fonts']
+
+
+def load_font(path, size):
+    key = (path, size)
+    if key not in _font_cache:
+        if path is None:
+            try:
+                _font_cache[key] = ImageFont.load_default(size=size)
+            except TypeError:
+                # Pillow < 10.1 only has the fixed-size bitmap font
+                _font_cache[key] = ImageFont.load_default()
+        else:
+            _font_cache[key] = ImageFont.truetype(path, size)
+    return _font_cache[key]
+
+
+def invoice_content(rng, settings):
+    """Header lines and item lines for one invoice"""
+    supplier = rng.choice(SUPPLIERS)
+    state_code = rng.randint(1, 37)
+    gstin = f"{state_code:02d}{''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(5))}" \
+            f"{rng.randint(1000, 9999)}{rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}1Z{rng.randint(1, 9)}"
+    header = [
+        "TAX INVOICE",
+        f"{supplier}, {rng.randint(1, 400)} Main Road, {rng.choice(CITIES)}",
+        f"GSTIN: {gstin}",
+        f"Invoice No: INV-{rng.randint(10000, 99999)}",
+        f"Invoice Date: {rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(2019, 2025)}",
+        f"Billed To: {rng.choice(CUSTOMERS)}, {rng.choice(CITIES)}",
+        "Item Qty Rate Amount"
+    ]
+
+    items = []
+    total = 0.0
+    for _ in range(rng.randint(*settings['items'])):
+        qty = rng.randint(1, 20)
+        rate = rng.randint(10, 5000) + rng.choice([0, 0.5, 0.25, 0.99])
+        amount = qty * rate
+        total += amount
+        items.append(f"{rng.choice(ITEMS)} {qty} {rate:.2f} {amount:.2f}")
+
+    tax = round(total * 0.18, 2)
+    footer = [
+        f"Subtotal: {total:.2f}",
+        f"GST 18%: {tax:.2f}",
+        f"Total: Rs. {total + tax:.2f}"
+    ]
+    return header, items, footer
+
+
+def draw_line(draw, position, text, font, rng, handwriting):
+    """Draw a text line; handwriting jitters each glyph's baseline and spacing"""
+    x, y = position
+    if not handwriting:
+        draw.text((x, y), text, fill=(20, 20, 20), font=font)
+        return
+    for char in text:
+        draw.text((x, y + rng.uniform(-2, 2)), char, fill=(20, 30, 90), font=font)
+        x += draw.textlength(char, font=font) * rng.uniform(0.95, 1.12)
+
+
+def degrade(image, rng, settings):
+    """Apply skew and sensor noise"""
+    if settings['skew']:
+        angle = rng.uniform(-settings['skew'], settings['skew'])
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=(255, 255, 255))
+    if settings['noise']:
+        pixels = np.asarray(image, dtype=np.float32)
+        noise = np.random.default_rng(rng.randint(0, 2 ** 32 - 1)).normal(0, 255 * settings['noise'], pixels.shape)
+        image = Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+    return image
+
+
+def render_invoice(index, output_dir, truth_dir=None, seed=0, **overrides):
+    """Render one invoice (one file per page); returns [(image_path, text), ...]"""
+    settings = dict(SYNTHETIC_SETTINGS, **overrides)
+    rng = random.Random(seed * 1000003 + index)
+    printed_fonts, handwriting_fonts = find_fonts()
+
+    dpi = settings['dpi']
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    margin = int(0.6 * dpi)
+    size = max(10, int(dpi * 0.15))
+    line_height = int(size * 1.6)
+
+    handwriting = rng.random() < settings['handwriting']
+    header_font = load_font(rng.choice(printed_fonts) if printed_fonts else None, int(size * 1.2))
+    body_path = None
+    if handwriting and handwriting_fonts:
+        body_path = rng.choice(handwriting_fonts)
+    elif printed_fonts:
+        body_path = rng.choice(printed_fonts)
+    body_font = load_font(body_path, size)
+
+    header, items, footer = invoice_content(rng, settings)
+    rows_per_page = max(1, (height - 2 * margin) // line_height - len(header) - len(footer))
+    pages = max(settings['pages'], -(-len(items) // rows_per_page))
+    per_page = -(-len(items) // pages)
+
+    outputs = []
+    base_name = f"invoice_{index:06d}"
+    for page in range(pages):
+        image = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(image)
+        lines = []
+        y = margin
+
+        page_header = header if page == 0 else [f"{header[3]} (page {page + 1} of {pages})", header[6]]
+        for line in page_header:
+            draw.text((margin, y), line, fill=(0, 0, 0), font=header_font)
+            lines.append(line)
+            y += line_height
+        draw.line((margin, y, width - margin, y), fill=(90, 90, 90), width=max(1, dpi // 100))
+        y += line_height // 2
+
+        for line in items[page * per_page:(page + 1) * per_page]:
+            draw_line(draw, (margin, y), line, body_font, rng, handwriting)
+            lines.append(line)
+            y += line_height
+
+        if page == pages - 1:
+            y += line_height // 2
+            for line in footer:
+                draw_line(draw, (margin, y), line, body_font, rng, handwriting)
+                lines.append(line)
+                y += line_height
+
+        image = degrade(image, rng, settings)
+        suffix = f"_p{page + 1}" if pages > 1 else ""
+        image_path = os.path.join(output_dir, f"{base_name}{suffix}.{settings['format']}")
+        save_args = {'dpi': (dpi, dpi)}
+        if settings['format'] in ('jpg', 'jpeg', 'webp'):
+            save_args['quality'] = settings['quality']
+        image.save(image_path, **save_args)
+
+        text = "\n".join(lines)
+        if truth_dir:
+            with open(os.path.join(truth_dir, f"{base_name}{suffix}.txt"), 'w', encoding='utf-8') as f:
+                f.write(text)
+        outputs.append((image_path, text))
+    return outputs
+
+
+def _render_task(args):
+    index, output_dir, truth_dir, seed, overrides = args
+    return render_invoice(index, output_dir, truth_dir, seed, **overrides)
+
+
+def generate(count, output_dir, truth_dir=None, seed=0, workers=None, start=0, **overrides):
+    """Render `count` invoices in parallel; returns [(image_path, text), ...] for every page"""
+    os.makedirs(output_dir, exist_ok=True)
+    if truth_dir:
+        os.makedirs(truth_dir, exist_ok=True)
+
+    tasks = [(index, output_dir, truth_dir, seed, overrides) for index in range(start, start + count)]
+    workers = workers or os.cpu_count() or 1
+    samples = []
+    if workers == 1 or count < 8:
+        for task in tasks:
+            samples += _render_task(task)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for i, pages in enumerate(pool.imap(_render_task, tasks, chunksize=16), 1):
+                samples += pages
+                if i % 1000 == 0:
+                    logger.info(f"Rendered {i}/{count} invoices")
+
+    logger.info(f"Rendered {count} invoices ({len(samples)} pages) into {output_dir}")
+    return samples
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Render synthetic invoices with known text")
+    parser.add_argument("output_dir", help="Folder for rendered images")
+    parser.add_argument("--count", "-n", type=int, default=100)
+    parser.add_argument("--truth", help="Folder for ground-truth .txt files (default: <output_dir>_truth)")
+    parser.add_argument("--dpi", type=int, default=SYNTHETIC_SETTINGS['dpi'])
+    parser.add_argument("--noise", type=float, default=SYNTHETIC_SETTINGS['noise'])
+    parser.add_argument("--skew", type=float, default=SYNTHETIC_SETTINGS['skew'])
+    parser.add_argument("--handwriting", type=float, default=SYNTHETIC_SETTINGS['handwriting'])
+    parser.add_argument("--pages", type=int, default=SYNTHETIC_SETTINGS['pages'])
+    parser.add_argument("--format", choices=['png', 'jpg', 'webp', 'tiff'], default=SYNTHETIC_SETTINGS['format'])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, help="Render processes (default: all cores)")
+
+    args = parser.parse_args()
+    truth_dir = args.truth or args.output_dir.rstrip('/\\') + '_truth'
+    generate(args.count, args.output_dir, truth_dir, args.seed, args.workers,
+             dpi=args.dpi, noise=args.noise, skew=args.skew, handwriting=args.handwriting,
+             pages=args.pages, format=args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import os
+import sys
+import time
+import logging
+import cProfile
+import threading
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import TELEMETRY_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_logging_configured = False
+_exporters_started = False
+
+
+def setup_logging(level=None):
+    """Configure logging once, for entry points; library modules only create loggers"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    logging.basicConfig(
+        level=level or TELEMETRY_SETTINGS['log_level'],
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    for name in TELEMETRY_SETTINGS['quiet_loggers']:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    _logging_configured = True
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines += self._render_value(key, value)
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=None):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets or TELEMETRY_SETTINGS['latency_buckets'])
+        if self.buckets[-1] != float('inf'):
+            self.buckets += (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        for bound, count in zip(self.buckets, counts):
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', le)])} {count}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        RESIDENT_MEMORY.set(resident_memory_bytes())
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+def resident_memory_bytes():
+    """Current RSS from /proc where available, else the peak RSS"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+REGISTRY = Registry()
+
+IMAGES = REGISTRY.register(Counter('ocr_images_total', 'Images finished, by outcome', ('status',)))
+QUARANTINED = REGISTRY.register(Counter('ocr_quarantined_total', 'Inputs quarantined after a timeout or crash'))
+STAGE_SECONDS = REGISTRY.register(Histogram('ocr_stage_seconds', 'Per-stage and per-engine latency per image',
+                                            ('stage',)))
+CROP_KEPT = REGISTRY.register(Histogram('ocr_crop_kept_fraction', 'Fraction of pixels kept by text-region cropping',
+                                        buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)))
+PROFILES = REGISTRY.register(Counter('ocr_preprocess_profile_total', 'Preprocessing profile chosen', ('profile',)))
+IMAGES_PER_SECOND = REGISTRY.register(Gauge('ocr_images_per_second', 'Throughput of the running batch'))
+QUEUE_DEPTH = REGISTRY.register(Gauge('ocr_queue_depth', 'Items waiting in each pipeline or work queue', ('queue',)))
+CACHE = REGISTRY.register(Counter('ocr_cache_total', 'Cache lookups by cache and result', ('cache', 'result')))
+MODEL_LOAD_SECONDS = REGISTRY.register(Histogram('ocr_model_load_seconds', 'TR-OCR model load time', ('model',)))
+RESIDENT_MEMORY = REGISTRY.register(Gauge('process_resident_memory_bytes', 'Resident set size of this process'))
+
+
+def record_result(result, error=None):
+    """Count one finished image and observe its stage timings"""
+    if error is not None or (result or {}).get('error'):
+        IMAGES.inc(status='error')
+        return
+    IMAGES.inc(status='ok' if result.get('best_result', {}).get('text') else 'empty')
+    for stage, value in result.get('stage_timings', {}).items():
+        if stage == 'profile':
+            PROFILES.inc(profile=value)
+        elif stage == 'crop_fraction':
+            CROP_KEPT.observe(value)
+        elif stage not in ('skew_angle', 'preprocess_saved') and isinstance(value, (int, float)):
+            STAGE_SECONDS.observe(value, stage=stage)
+
+
+def dump_metrics(path):
+    """Write the metrics text atomically, for node_exporter's textfile collector or manual reads"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would otherwise flood stderr
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics at http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def _dump_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            dump_metrics(path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {e}")
+
+
+def start_exporters():
+    """Start the configured metrics endpoint and periodic dump file, once per process"""
+    global _exporters_started
+    if _exporters_started:
+        return
+    _exporters_started = True
+    if TELEMETRY_SETTINGS['metrics_port'] is not None:
+        start_metrics_server(TELEMETRY_SETTINGS['metrics_port'], TELEMETRY_SETTINGS['metrics_host'])
+    if TELEMETRY_SETTINGS['metrics_file']:
+        threading.Thread(target=_dump_loop, daemon=True,
+                         args=(TELEMETRY_SETTINGS['metrics_file'], TELEMETRY_SETTINGS['dump_interval'])).start()
+
+
+def flush_exporters():
+    if TELEMETRY_SETTINGS['metrics_file']:
+        dump_metrics(TELEMETRY_SETTINGS['metrics_file'])
+
+
+class SamplingProfiler:
+    """Samples every thread's stack on a timer and writes collapsed stacks (py-spy --format raw)"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or TELEMETRY_SETTINGS['profile_interval']
+        self.stacks = _Tally()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, path):
+        self.stop_event.set()
+        self.thread.join()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiling(path):
+    """Profile the block: .prof writes cProfile stats, anything else collapsed stacks for flamegraphs"""
+    if not path:
+        yield
+        return
+    if path.endswith('.prof'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    else:
+        # Sampling sees the pipeline stage threads too; cProfile only sees the calling thread
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop(path)
+    logger.info(f"Profile written to {path}")
@@ -1,15 +1,20 @@
 import pytesseract
-import cv2
-import numpy as np
-from PIL import Image
+import os
+import shlex
+import tempfile
+import subprocess
 import logging
-from config import TESSERACT_CONFIGS, TESSERACT_PATHS
+from contextlib import contextmanager
+from page_image import PageImage
+from config import TESSERACT_CONFIGS, TESSERACT_LANGUAGES, TESSERACT_PATHS, TIMEOUT_SETTINGS
+from resource_manager import get_resource_manager
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class TesseractExtractor:
-    def __init__(self):
+    def __init__(self, resources=None):
+        self.resources = resources or get_resource_manager()
+        self.resources.apply_tesseract()
         self.setup_tesseract()
         logger.info("Tesseract OCR initialized")
     
@@ -26,43 +31,69 @@ class TesseractExtractor:
                 continue
         logger.warning("Tesseract not found in standard paths. Please set the path manually.")
     
+    @contextmanager
+    def page_file(self, image):
+        """Write the page once as uncompressed PNM for every config run to read"""
+        # Handed an image object, pytesseract PNG-encodes it to a temp file on every call
+        page = PageImage.wrap(image)
+        fd, path = tempfile.mkstemp(prefix='tess_', suffix='.pgm' if page.is_gray else '.ppm')
+        os.close(fd)
+        try:
+            page.save_pnm(path)
+            yield path
+        finally:
+            os.remove(path)
+    
+    def _image_to_string(self, path, config_name):
+        config = TESSERACT_CONFIGS.get(config_name, TESSERACT_CONFIGS['auto'])
+        
+        seconds = TIMEOUT_SETTINGS['tesseract_seconds'] or None
+        # "stdout" as the output base returns the text on the pipe, with no output file to clean up
+        args = [pytesseract.pytesseract.tesseract_cmd, path, 'stdout', '-l', TESSERACT_LANGUAGES]
+        args += shlex.split(config, posix=os.name != 'nt')
+        # Run directly rather than through pytesseract, which only kills tesseract on its own
+        # timeout: an image budget expiring mid-run would leave the process burning a core
+        proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        try:
+            output, errors = proc.communicate(timeout=seconds)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise RuntimeError(f"Tesseract ran past its {seconds}s budget")
+        except BaseException:
+            # ImageTimeout (or Ctrl-C) raised while waiting on tesseract
+            proc.kill()
+            proc.communicate()
+            raise
+        if proc.returncode:
+            raise pytesseract.TesseractError(proc.returncode, errors.decode('utf-8', 'replace').strip())
+        return output.decode('utf-8').strip()
+    
     def extract_text(self, image, config_name='auto'):
-        """Extract text using Tesseract"""
+        """Extract text using Tesseract from a path, numpy array, PIL image or PageImage"""
         try:
-            if isinstance(image, str):
-                # Image path provided
-                image_obj = Image.open(image)
-            elif isinstance(image, np.ndarray):
-                # numpy array provided
-                image_obj = Image.fromarray(image)
-            else:
-                # PIL Image provided
-                image_obj = image
-            
-            config = TESSERACT_CONFIGS.get(config_name, TESSERACT_CONFIGS['auto'])
-            
-            # Extract text
-            text = pytesseract.image_to_string(image_obj, config=config)
-            
-            return text.strip()
+            with self.page_file(image) as path:
+                return self._image_to_string(path, config_name)
             
         except Exception as e:
             logger.error(f"Tesseract extraction failed: {e}")
             return ""
     
-    def extract_with_multiple_configs(self, image):
-        """Try multiple Tesseract configurations"""
+    def extract_with_multiple_configs(self, image, config_names=None):
+        """Try multiple Tesseract configurations (all of them unless config_names is given)"""
         results = {}
         
-        for config_name in TESSERACT_CONFIGS.keys():
-            try:
-                text = self.extract_text(image, config_name)
-                results[config_name] = text
-                if text:
-                    logger.info(f"Tesseract ({config_name}): Found {len(text)} characters")
-            except Exception as e:
-                logger.error(f"Tesseract ({config_name}) failed: {e}")
-                results[config_name] = ""
+        with self.page_file(image) as path:
+            for config_name in config_names or TESSERACT_CONFIGS.keys():
+                try:
+                    text = self._image_to_string(path, config_name)
+                    results[config_name] = text
+                    if text:
+                        logger.info(f"Tesseract ({config_name}): Found {len(text)} characters")
+                except Exception as e:
+                    logger.error(f"Tesseract ({config_name}) failed: {e}")
+                    results[config_name] = ""
         
         # Find the best result (most text)
         best_text = ""
@@ -0,0 +1,187 @@
+import re
+import math
+import logging
+from telemetry import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS text_index_docs (
+    id INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    original TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_text_index_docs_file ON text_index_docs(file_path);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS text_index_fts USING fts5(folded, tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS text_index_vocab USING fts5vocab(text_index_fts, row);
+"""
+
+# Characters OCR engines commonly confuse are folded to one representative
+OCR_CONFUSIONS = str.maketrans({
+    'o': '0', 'q': '0', 'd': '0',
+    'i': '1', 'l': '1', '|': '1', '!': '1',
+    's': '5', 'z': '2', 'b': '8', 'g': '9',
+    '‘': None, '’': None
+})
+
+_NON_ALNUM = re.compile(r'[\W_]+')
+
+
+def fold(text):
+    """Case-fold, merge confusable characters and drop spacing and punctuation"""
+    return _NON_ALNUM.sub('', text.casefold().translate(OCR_CONFUSIONS))
+
+
+def trigrams(folded):
+    return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+
+def engine_texts(result):
+    """Texts worth indexing for one image: every engine's output, keyed by engine"""
+    all_results = result.get('all_results', {})
+    texts = {
+        'tesseract': all_results.get('tesseract', {}).get('best_text', ''),
+        'trocr_printed': all_results.get('trocr_printed', {}).get('text', ''),
+        'trocr_handwritten': all_results.get('trocr_handwritten', {}).get('text', '')
+    }
+    if not any(texts.values()):
+        texts['best'] = result.get('best_result', {}).get('text', '')
+    return {engine: text for engine, text in texts.items() if text}
+
+
+class TextIndex:
+    """OCR-error tolerant inverted index (FTS5 trigrams) over extracted invoice text"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.executescript(SCHEMA)
+
+    def add(self, file_path, result):
+        """Replace the indexed texts for one image"""
+        self.remove(file_path)
+        for engine, text in engine_texts(result).items():
+            cursor = self.conn.execute(
+                "INSERT INTO text_index_docs (file_path, engine, original) VALUES (?, ?, ?)",
+                (file_path, engine, text)
+            )
+            self.conn.execute(
+                "INSERT INTO text_index_fts (rowid, folded) VALUES (?, ?)",
+                (cursor.lastrowid, fold(text))
+            )
+
+    def remove(self, file_path):
+        ids = [row[0] for row in self.conn.execute(
+            "SELECT id FROM text_index_docs WHERE file_path = ?", (file_path,))]
+        for doc_id in ids:
+            self.conn.execute("DELETE FROM text_index_fts WHERE rowid = ?", (doc_id,))
+        self.conn.execute("DELETE FROM text_index_docs WHERE file_path = ?", (file_path,))
+
+    def clear(self):
+        self.conn.execute("DELETE FROM text_index_fts")
+        self.conn.execute("DELETE FROM text_index_docs")
+
+    def _rarest(self, grams, count):
+        """The count query trigrams found in the fewest documents"""
+        placeholders = ', '.join('?' for _ in grams)
+        docs = dict(self.conn.execute(
+            f"SELECT term, doc FROM text_index_vocab WHERE term IN ({placeholders})", sorted(grams)
+        ).fetchall())
+        return sorted(grams, key=lambda gram: docs.get(gram, 0))[:count]
+
+    def search(self, query, limit=20, min_score=0.5, candidates=20000):
+        """Find images whose text approximately contains query, best match first"""
+        folded_query = fold(query)
+        if len(folded_query) < 3:
+            raise ValueError("Search text needs at least 3 letters or digits")
+
+        # Exact (folded) substring matches first; they need no fuzzy scoring
+        exact = self.conn.execute(
+            "SELECT rowid FROM text_index_fts WHERE folded MATCH ? LIMIT ?",
+            ('"' + folded_query + '"', limit)
+        ).fetchall()
+        if exact:
+            return self._matches([(row[0], 1.0) for row in exact], folded_query, limit)
+
+        # A document sharing at least needed of the n query trigrams must contain one of the
+        # n - needed + 1 rarest, so only those are looked up; common ones ("a1z") match everything
+        query_grams = trigrams(folded_query)
+        needed = max(1, math.ceil(min_score * len(query_grams)))
+        rare = self._rarest(query_grams, len(query_grams) - needed + 1)
+        fts_query = ' OR '.join(f'"{gram}"' for gram in rare)
+        rows = self.conn.execute(
+            "SELECT rowid, folded FROM text_index_fts WHERE folded MATCH ? LIMIT ?",
+            (fts_query, candidates)
+        ).fetchall()
+
+        scored = []
+        for doc_id, folded in rows:
+            # Substring tests instead of building each document's trigram set
+            score = sum(gram in folded for gram in query_grams) / len(query_grams)
+            if score >= min_score:
+                scored.append((doc_id, score))
+        scored.sort(key=lambda item: -item[1])
+        return self._matches(scored, folded_query, limit)
+
+    def _matches(self, scored, folded_query, limit):
+        """Collapse engine rows to one hit per image and attach the best matching line"""
+        query_grams = trigrams(folded_query)
+        matches = []
+        seen = set()
+        for doc_id, score in scored:
+            row = self.conn.execute(
+                "SELECT file_path, engine, original FROM text_index_docs WHERE id = ?", (doc_id,)
+            ).fetchone()
+            if row is None or row[0] in seen:
+                continue
+            seen.add(row[0])
+            lines = [line for line in row[2].splitlines() if line.strip()] or [row[2]]
+            best_line = max(lines, key=lambda line: len(query_grams & trigrams(fold(line))))
+            matches.append({
+                'file_path': row[0],
+                'engine': row[1],
+                'score': score,
+                'line': best_line.strip()
+            })
+            if len(matches) >= limit:
+                break
+        return matches
+
+
+def main():
+    import os
+    import argparse
+    import ntpath
+    from results_store import open_results
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Search extracted invoice text (tolerates OCR errors)")
+    parser.add_argument("query", help="Text to find, e.g. a GSTIN or invoice number")
+    parser.add_argument("--results", "-r", help="Results .db file or results JSON", default="batch_results.json")
+    parser.add_argument("--limit", "-n", type=int, default=20)
+    parser.add_argument("--min-score", type=float, default=0.5, help="Minimum trigram overlap for fuzzy hits")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.results):
+        print(f"Error: Results file '{args.results}' not found")
+        return
+
+    store = open_results(args.results)
+    try:
+        matches = store.text_index.search(args.query, args.limit, args.min_score)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    finally:
+        store.close()
+
+    for match in matches:
+        print(f"{ntpath.basename(match['file_path']):<30} {match['engine']:<18} {match['score']:.2f}  {match['line'][:80]}")
+    print(f"\n{len(matches)} match(es)")
+
+
+if __name__ == "__main__":
+    main()
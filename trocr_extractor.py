@@ -1,64 +1,141 @@
 import torch
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-from PIL import Image
+from transformers import LogitsProcessor, LogitsProcessorList
+from transformers.modeling_outputs import BaseModelOutput
 import logging
-import numpy as np
-from config import TROCR_MODELS
+import math
+from page_image import PageImage, pixel_batch
+from config import TROCR_MODELS, TROCR_DECODING, TROCR_INFERENCE, TROCR_LINES, TIMEOUT_SETTINGS
+from resource_manager import get_resource_manager
+from model_manager import get_model_manager
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Decoder positions projected onto the vocabulary at once when rescoring beam output
+LOGIT_CHUNK = 16
+
+class ChosenTokenLogProbs(LogitsProcessor):
+    """Record the log-probability of the greedy choice at each decoding step"""
+    def __init__(self):
+        self.log_probs = []
+    
+    def __call__(self, input_ids, scores):
+        # Only one scalar per row is kept; the vocabulary-sized scores are not retained
+        self.log_probs.append(scores.max(dim=-1).values - torch.logsumexp(scores, dim=-1))
+        return scores
+
 class TRoCRExtractor:
-    def __init__(self, model_type='printed'):
+    def __init__(self, model_type='printed', adaptive_decoding=None, resources=None, models=None):
+        self.resources = resources or get_resource_manager()
+        self.resources.apply_torch()
+        self.models = models or get_model_manager()
+        
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         logger.info(f"Using device: {self.device}")
         
         self.model_type = model_type
         self.model_name = TROCR_MODELS.get(model_type, TROCR_MODELS['printed'])
         
+        if adaptive_decoding is None:
+            adaptive_decoding = TROCR_DECODING['adaptive']
+        self.adaptive_decoding = adaptive_decoding
+        self.inference_mode = TROCR_INFERENCE['inference_mode']
+        
         self.load_model()
     
     def load_model(self):
         """Load TR-OCR model"""
         try:
-            logger.info(f"Loading TR-OCR model: {self.model_name}")
-            self.processor = TrOCRProcessor.from_pretrained(self.model_name)
-            self.model = VisionEncoderDecoderModel.from_pretrained(self.model_name)
-            self.model.to(self.device)
-            self.model.eval()
+            self.models.get(self.model_name)
             logger.info("TR-OCR model loaded successfully")
         except Exception as e:
             logger.error(f"Error loading TR-OCR model: {e}")
             raise
     
+    # The manager may evict a variant between calls, so weights are looked up rather than held.
+    # Each lookup counts as a use, so extraction methods fetch (processor, model) once per call
+    @property
+    def processor(self):
+        return self.models.get(self.model_name)[0]
+    
+    @property
+    def model(self):
+        return self.models.get(self.model_name)[1]
+    
+    def _inference_context(self):
+        """inference_mode skips the version counters no_grad still maintains"""
+        return torch.inference_mode() if self.inference_mode else torch.no_grad()
+    
+    def decoding_params(self, image_obj, line=False):
+        """Choose greedy or beam search and a token budget from the crop geometry"""
+        params = self._token_params(image_obj, line)
+        if TIMEOUT_SETTINGS['trocr_seconds']:
+            # generate stops at the time budget and returns what it has decoded so far
+            params['max_time'] = TIMEOUT_SETTINGS['trocr_seconds']
+        return params
+    
+    def _token_params(self, image_obj, line=False):
+        fixed = {'max_length': 512, 'num_beams': 4, 'early_stopping': True}
+        if not self.adaptive_decoding:
+            return fixed
+        
+        settings = TROCR_DECODING
+        w, h = image_obj.size
+        # The character estimate below holds for a single text line only; a whole page would
+        # estimate a handful of characters and cap decoding far below its real length. Crops from
+        # line detection are known to be lines, however short the word they hold
+        if not line and w < h * settings['line_min_aspect']:
+            return fixed
+        
+        # A single text line holds roughly width / (glyph width) characters
+        estimated_chars = w / max(h * settings['char_aspect'], 1)
+        estimated_tokens = estimated_chars / settings['chars_per_token']
+        max_new_tokens = int(math.ceil(estimated_tokens * settings['token_margin']))
+        max_new_tokens = max(settings['min_new_tokens'], min(max_new_tokens, settings['max_new_tokens']))
+        
+        if max_new_tokens <= settings['greedy_max_tokens']:
+            return {'max_new_tokens': max_new_tokens, 'num_beams': 1}
+        return {'max_new_tokens': max_new_tokens, 'num_beams': settings['num_beams'], 'early_stopping': True}
+    
+    def _to_page(self, image):
+        """Wrap a path, numpy array, PIL image or PageImage without copying where possible"""
+        return PageImage.wrap(image)
+    
+    def pixel_values(self, pages, processor, model):
+        """Encoder input for a list of pages, on the model's device"""
+        image_processor = processor.image_processor
+        if not TROCR_INFERENCE['numpy_pixel_values']:
+            return processor(images=[page.to_pil().convert('RGB') for page in pages],
+                             return_tensors="pt").pixel_values.to(self.device, dtype=model.dtype)
+        
+        # Same resize / rescale / normalize as the processor, vectorized on the page buffers
+        size = image_processor.size
+        batch = pixel_batch(
+            pages, size['width'], size['height'],
+            scale=image_processor.rescale_factor if image_processor.do_rescale else 1.0,
+            mean=image_processor.image_mean if image_processor.do_normalize else (0.0, 0.0, 0.0),
+            std=image_processor.image_std if image_processor.do_normalize else (1.0, 1.0, 1.0)
+        )
+        # from_numpy shares the buffer; only the device copy or a half-precision cast moves data
+        return torch.from_numpy(batch).to(self.device, dtype=model.dtype)
+    
     def extract_text(self, image):
         """Extract text using TR-OCR"""
         try:
-            if isinstance(image, str):
-                # Image path provided
-                image_obj = Image.open(image).convert('RGB')
-            elif isinstance(image, np.ndarray):
-                # numpy array provided
-                image_obj = Image.fromarray(image)
-            else:
-                # PIL Image provided
-                image_obj = image.convert('RGB')
+            image_obj = self._to_page(image)
+            processor, model = self.models.get(self.model_name)
             
             # Preprocess for TR-OCR
-            pixel_values = self.processor(images=image_obj, return_tensors="pt").pixel_values
-            pixel_values = pixel_values.to(self.device)
+            pixel_values = self.pixel_values([image_obj], processor, model)
             
             # Generate text
-            with torch.no_grad():
-                generated_ids = self.model.generate(
+            with self._inference_context():
+                generated_ids = model.generate(
                     pixel_values,
-                    max_length=512,
-                    num_beams=4,
-                    early_stopping=True,
-                    no_repeat_ngram_size=2
+                    no_repeat_ngram_size=2,
+                    **self.decoding_params(image_obj)
                 )
             
-            extracted_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+            extracted_text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
             
             return extracted_text.strip()
             
@@ -66,44 +143,197 @@ class TRoCRExtractor:
             logger.error(f"TR-OCR extraction failed: {e}")
             return ""
     
+    def _generate_with_confidence(self, processor, model, pixel_values, params):
+        """Run generate and return (text, confidence, token confidences) for each image in the batch"""
+        with self._inference_context():
+            if params['num_beams'] == 1:
+                # Greedy: the chosen token is the argmax, so its log-prob is recorded while decoding
+                recorder = ChosenTokenLogProbs()
+                sequences = model.generate(
+                    pixel_values,
+                    logits_processor=LogitsProcessorList([recorder]),
+                    **params
+                )
+                token_log_probs = torch.stack(recorder.log_probs, dim=-1) if recorder.log_probs else None
+            else:
+                # Beam search: rescore the winning sequences once against the cached encoder output
+                encoder_outputs = model.get_encoder()(pixel_values=pixel_values)
+                sequences = model.generate(
+                    pixel_values,
+                    # generate expands encoder outputs per beam in place, so hand it a wrapper
+                    encoder_outputs=BaseModelOutput(last_hidden_state=encoder_outputs.last_hidden_state),
+                    **params
+                )
+                token_log_probs = self._sequence_log_probs(model, encoder_outputs, sequences)
+        
+        # Decode text
+        texts = processor.batch_decode(sequences, skip_special_tokens=True)
+        
+        # Tokens after the first end-of-sequence are padding for rows that finished early
+        tokens = sequences[:, 1:]
+        is_eos = (tokens == processor.tokenizer.eos_token_id).long()
+        valid = (is_eos.cumsum(dim=-1) - is_eos) == 0
+        
+        outputs = []
+        for row, text in enumerate(texts):
+            # Calculate confidence
+            confidence = 0.0
+            token_confidences = []
+            if token_log_probs is not None:
+                token_probs = token_log_probs[row][valid[row, :token_log_probs.shape[1]]].exp()
+                if token_probs.numel():
+                    confidence = token_probs.mean().item()
+                    token_confidences = token_probs.tolist()
+            outputs.append((text.strip(), confidence, token_confidences))
+        
+        return outputs
+    
+    def _sequence_log_probs(self, model, encoder_outputs, sequences):
+        """Log-probabilities of the generated tokens, gathered without a full softmax"""
+        decoder_input_ids = sequences[:, :-1]
+        targets = sequences[:, 1:]
+        if targets.shape[1] == 0:
+            return None
+        
+        encoder_hidden_states = encoder_outputs.last_hidden_state
+        # The projection VisionEncoderDecoderModel.forward applies when encoder and decoder widths differ
+        if hasattr(model, 'enc_to_dec_proj'):
+            encoder_hidden_states = model.enc_to_dec_proj(encoder_hidden_states)
+        
+        # Decoder hidden states only; the decoder is causal, so padding after a finished row
+        # does not affect earlier positions
+        hidden = model.decoder.get_decoder()(
+            input_ids=decoder_input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            use_cache=False
+        )[0]
+        
+        # The vocabulary projection runs a few positions at a time, so no B x T x V logits exist
+        head = model.decoder.get_output_embeddings()
+        log_probs = []
+        for start in range(0, targets.shape[1], LOGIT_CHUNK):
+            logits = head(hidden[:, start:start + LOGIT_CHUNK])
+            chosen = logits.gather(-1, targets[:, start:start + LOGIT_CHUNK].unsqueeze(-1)).squeeze(-1)
+            log_probs.append(chosen - torch.logsumexp(logits, dim=-1))
+        return torch.cat(log_probs, dim=1)
+    
+    def _should_retry(self, params, confidence):
+        """Low-confidence greedy output gets one beam search retry"""
+        retry_confidence = TROCR_DECODING['retry_confidence']
+        return (self.adaptive_decoding and retry_confidence is not None and
+                params['num_beams'] == 1 and confidence < retry_confidence)
+    
+    def _beam_params(self, params):
+        return dict(params, num_beams=TROCR_DECODING['num_beams'], early_stopping=True)
+    
+    def _confidence_result(self, text, confidence, token_confidences, num_beams):
+        return {
+            'text': text,
+            'confidence': confidence,
+            'token_confidences': token_confidences,
+            'model': self.model_name,
+            'num_beams': num_beams
+        }
+    
     def extract_with_confidence(self, image):
         """Extract text with confidence scores"""
         try:
-            if isinstance(image, str):
-                image_obj = Image.open(image).convert('RGB')
-            else:
-                image_obj = image.convert('RGB')
+            image_obj = self._to_page(image)
+            processor, model = self.models.get(self.model_name)
             
-            pixel_values = self.processor(images=image_obj, return_tensors="pt").pixel_values
-            pixel_values = pixel_values.to(self.device)
-            
-            with torch.no_grad():
-                generated_output = self.model.generate(
-                    pixel_values,
-                    max_length=512,
-                    num_beams=4,
-                    early_stopping=True,
-                    return_dict_in_generate=True,
-                    output_scores=True
-                )
+            pixel_values = self.pixel_values([image_obj], processor, model)
             
-            # Decode text
-            text = self.processor.batch_decode(generated_output.sequences, skip_special_tokens=True)[0]
+            params = self.decoding_params(image_obj)
+            text, confidence, token_confidences = self._generate_with_confidence(
+                processor, model, pixel_values, params)[0]
             
-            # Calculate confidence
-            confidence = 0.0
-            if hasattr(generated_output, 'scores') and generated_output.scores:
-                scores = generated_output.scores
-                probs = [torch.nn.functional.softmax(score, dim=-1) for score in scores]
-                max_probs = [torch.max(prob, dim=-1)[0] for prob in probs]
-                confidence = torch.stack(max_probs).mean().item()
+            if self._should_retry(params, confidence):
+                logger.info(f"Confidence {confidence:.3f} below {TROCR_DECODING['retry_confidence']}, retrying with beam search")
+                params = self._beam_params(params)
+                text, confidence, token_confidences = self._generate_with_confidence(
+                    processor, model, pixel_values, params)[0]
             
-            return {
-                'text': text.strip(),
-                'confidence': confidence,
-                'model': self.model_name
-            }
+            return self._confidence_result(text, confidence, token_confidences, params['num_beams'])
             
         except Exception as e:
             logger.error(f"TR-OCR confidence extraction failed: {e}")
-            return {'text': '', 'confidence': 0.0, 'model': self.model_name}
\ No newline at end of file
+            return {'text': '', 'confidence': 0.0, 'token_confidences': [], 'model': self.model_name}
+    
+    def extract_batch_with_confidence(self, images, lines=False):
+        """Extract text with confidence scores for several images in batched generate calls"""
+        image_objs = [self._to_page(image) for image in images]
+        # Fetched once per call: every manager lookup counts as a use for eviction and in the metrics
+        processor, model = self.models.get(self.model_name)
+        results = [None] * len(image_objs)
+        
+        # Images that share a search strategy and budget kind (pages: max_length, lines: max_new_tokens)
+        # are decoded together under the largest token budget
+        groups = {}
+        for index, image_obj in enumerate(image_objs):
+            params = self.decoding_params(image_obj, lines)
+            budget_key = 'max_new_tokens' if 'max_new_tokens' in params else 'max_length'
+            groups.setdefault((params['num_beams'], budget_key), []).append((index, params))
+        
+        for (num_beams, budget_key), members in groups.items():
+            indices = [index for index, _ in members]
+            params = dict(members[0][1])
+            params[budget_key] = max(member_params[budget_key] for _, member_params in members)
+            
+            try:
+                pixel_values = self.pixel_values([image_objs[i] for i in indices], processor, model)
+                outputs = self._generate_with_confidence(processor, model, pixel_values, params)
+            except Exception as e:
+                logger.error(f"TR-OCR batch extraction failed: {e}")
+                for index in indices:
+                    results[index] = {'text': '', 'confidence': 0.0, 'token_confidences': [], 'model': self.model_name}
+                continue
+            
+            for row, (index, member_params) in enumerate(members):
+                text, confidence, token_confidences = outputs[row]
+                used_beams = num_beams
+                if self._should_retry(params, confidence):
+                    retry_params = self._beam_params(member_params)
+                    text, confidence, token_confidences = self._generate_with_confidence(
+                        processor, model, pixel_values[row:row + 1], retry_params)[0]
+                    used_beams = retry_params['num_beams']
+                results[index] = self._confidence_result(text, confidence, token_confidences, used_beams)
+        
+        return results
+    
+    def extract_lines_with_confidence(self, image, line_boxes):
+        """Decode a page line by line from (x0, y0, x1, y1) boxes; without boxes the page is decoded whole"""
+        return self.extract_lines_batch([image], [line_boxes])[0]
+    
+    def extract_lines_batch(self, images, line_boxes):
+        """extract_lines_with_confidence for several pages, batching line crops across pages"""
+        pages = [self._to_page(image) for image in images]
+        crops = []
+        owners = []
+        for index, (page, boxes) in enumerate(zip(pages, line_boxes)):
+            for x0, y0, x1, y1 in boxes or ():
+                crops.append(PageImage(page.array[y0:y1, x0:x1]))
+                owners.append(index)
+        
+        # Crops are ordered by page, so each generate call mixes at most a few pages
+        line_results = []
+        batch_size = TROCR_LINES['batch_size']
+        for start in range(0, len(crops), batch_size):
+            line_results.extend(self.extract_batch_with_confidence(crops[start:start + batch_size], lines=True))
+        
+        by_page = {}
+        for owner, result in zip(owners, line_results):
+            by_page.setdefault(owner, []).append(result)
+        return [self._join_lines(by_page[index]) if index in by_page else self.extract_with_confidence(page)
+                for index, page in enumerate(pages)]
+    
+    def _join_lines(self, lines):
+        """One page result from its line results; confidence is the mean over every decoded token"""
+        token_confidences = [value for line in lines for value in line['token_confidences']]
+        result = self._confidence_result(
+            '\n'.join(line['text'] for line in lines if line['text']),
+            sum(token_confidences) / len(token_confidences) if token_confidences else 0.0,
+            token_confidences,
+            max(line.get('num_beams', 0) for line in lines)
+        )
+        result['lines'] = len(lines)
+        return result
@@ -1,5 +1,6 @@
-import json
 import os
+from results_store import open_results, record
+from telemetry import setup_logging
 
 def view_extracted_text(results_file):
     """Display extracted text from results file in a clean format"""
@@ -8,14 +9,13 @@ def view_extracted_text(results_file):
         print(f"Error: Results file '{results_file}' not found")
         return
     
-    with open(results_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    store = open_results(results_file)
     
     print("EXTRACTED INVOICE TEXT RESULTS")
     print("=" * 80)
     
     # Display metadata
-    metadata = data.get('metadata', {})
+    metadata = store.latest_batch()
     print(f"Processing Date: {metadata.get('processing_date', 'N/A')}")
     print(f"Total Images: {metadata.get('total_images', 0)}")
     print(f"Successful: {metadata.get('successful', 0)}")
@@ -23,17 +23,14 @@ def view_extracted_text(results_file):
     print("=" * 80)
     
     # Display results for each file
-    results = data.get('results', {})
-    
-    for file_path, result in results.items():
-        filename = os.path.basename(file_path)
+    for row in store.iter_results():
+        filename = row['file_name']
         print(f"\n📄 FILE: {filename}")
         print("-" * 80)
         
-        best_result = result.get('best_result', {})
-        extracted_text = best_result.get('text', '')
-        method = best_result.get('method', 'N/A')
-        confidence = best_result.get('confidence', 0)
+        extracted_text = row['best_text'] or ''
+        method = row['method'] or 'N/A'
+        confidence = row['confidence'] or 0
         
         print(f"Method: {method} | Confidence: {confidence:.3f} | Length: {len(extracted_text)} chars")
         print("-" * 80)
@@ -52,26 +49,23 @@ def save_text_to_files(results_file, output_dir="extracted_texts"):
         print(f"Error: Results file '{results_file}' not found")
         return
     
-    with open(results_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    store = open_results(results_file)
     
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    results = data.get('results', {})
     saved_files = []
     
-    for file_path, result in results.items():
-        filename = os.path.basename(file_path)
+    for row in store.iter_results():
+        filename = row['file_name']
         base_name = os.path.splitext(filename)[0]
         output_file = os.path.join(output_dir, f"{base_name}_extracted.txt")
         
-        best_result = result.get('best_result', {})
-        extracted_text = best_result.get('text', '')
+        extracted_text = row['best_text'] or ''
         
         # Add metadata to the text file
-        method = best_result.get('method', 'N/A')
-        confidence = best_result.get('confidence', 0)
+        method = row['method'] or 'N/A'
+        confidence = row['confidence'] or 0
         
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(f"Source: {filename}\n")
@@ -93,17 +87,12 @@ def view_all_methods(results_file, specific_file=None):
         print(f"Error: Results file '{results_file}' not found")
         return
     
-    with open(results_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    store = open_results(results_file)
     
-    results = data.get('results', {})
-    
-    for file_path, result in results.items():
-        filename = os.path.basename(file_path)
-        
-        # If specific file is requested, skip others
-        if specific_file and specific_file not in filename:
-            continue
+    # Only the requested file is read when one is given
+    for row in store.iter_results(file=specific_file):
+        filename = row['file_name']
+        result = record(row)
         
         print(f"\n🔍 COMPARISON FOR: {filename}")
         print("=" * 80)
@@ -141,6 +130,8 @@ def view_all_methods(results_file, specific_file=None):
 
 def main():
     import argparse
+
+    setup_logging()
     
     parser = argparse.ArgumentParser(description="View extracted invoice text results")
     parser.add_argument("results_file", help="Path to results JSON file", default="batch_results.json", nargs='?')
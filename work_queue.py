@@ -0,0 +1,259 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from results_store import ResultsStore, store_path_for
+from config import WORK_QUEUE_SETTINGS
+import telemetry
+from telemetry import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY,
+    file_path TEXT UNIQUE NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_work_items_state ON work_items(state, lease_expires);
+"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Lease-based work queue in a SQLite file that every node can reach (e.g. a shared mount)"""
+
+    def __init__(self, db_path, lease_seconds=None, max_attempts=None):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds or WORK_QUEUE_SETTINGS['lease_seconds']
+        self.max_attempts = max_attempts or WORK_QUEUE_SETTINGS['max_attempts']
+        # Every node writes to this file, so wait on locks instead of failing fast
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, file_paths):
+        """Add items not already queued; returns how many were new"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        before = self.conn.total_changes
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO work_items (file_path, updated_at) VALUES (?, ?)",
+            [(path, now) for path in file_paths]
+        )
+        added = self.conn.total_changes - before
+        self.conn.execute("COMMIT")
+        return added
+
+    def claim(self, worker_id, count):
+        """Lease up to count pending items, or items whose worker stopped heartbeating"""
+        now = time.time()
+        # IMMEDIATE takes the write lock up front so two workers never lease the same rows
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Items that keep killing their workers are given up on rather than re-leased forever
+            self.conn.execute(
+                "UPDATE work_items SET state = 'failed', error = 'lease expired too many times', updated_at = ? "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = self.conn.execute(
+                "SELECT id, file_path, state, worker FROM work_items "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                "ORDER BY id LIMIT ?",
+                (now, count)
+            ).fetchall()
+            for row in rows:
+                if row['state'] == 'leased':
+                    logger.warning(f"Re-leasing {row['file_path']} from unresponsive worker {row['worker']}")
+            self.conn.executemany(
+                "UPDATE work_items SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(worker_id, now + self.lease_seconds, now, row['id']) for row in rows]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [row['file_path'] for row in rows]
+
+    def heartbeat(self, worker_id):
+        """Extend every lease this worker holds"""
+        now = time.time()
+        self.conn.execute(
+            "UPDATE work_items SET lease_expires = ?, updated_at = ? WHERE state = 'leased' AND worker = ?",
+            (now + self.lease_seconds, now, worker_id)
+        )
+
+    def ack(self, worker_id, file_path):
+        self.conn.execute(
+            "UPDATE work_items SET state = 'done', worker = ?, lease_expires = NULL, error = NULL, updated_at = ? "
+            "WHERE file_path = ?",
+            (worker_id, time.time(), file_path)
+        )
+
+    def fail(self, worker_id, file_path, error):
+        """Return a failed item to the queue, or give up after max_attempts"""
+        self.conn.execute(
+            "UPDATE work_items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = ?, lease_expires = NULL, error = ?, updated_at = ? WHERE file_path = ?",
+            (self.max_attempts, worker_id, error, time.time(), file_path)
+        )
+
+    def counts(self):
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for row in self.conn.execute("SELECT state, COUNT(*) AS n FROM work_items GROUP BY state"):
+            counts[row['state']] = row['n']
+        return counts
+
+    def workers(self):
+        """Workers currently holding leases, with how many items each"""
+        return {row['worker']: row['n'] for row in self.conn.execute(
+            "SELECT worker, COUNT(*) AS n FROM work_items WHERE state = 'leased' GROUP BY worker")}
+
+
+def _heartbeat_loop(queue_path, worker_id, stop, interval):
+    # SQLite connections stay on the thread that opened them
+    queue = WorkQueue(queue_path)
+    try:
+        while not stop.wait(interval):
+            queue.heartbeat(worker_id)
+    finally:
+        queue.close()
+
+
+def run_coordinator(input_folder, queue_path, output_file="batch_results.json", wait=True):
+    """Queue every image in a folder, then report progress until workers drain the queue"""
+    from batch_processor import IMAGE_EXTENSIONS
+
+    image_files = sorted(os.path.abspath(os.path.join(input_folder, file)) for file in os.listdir(input_folder)
+                         if file.lower().endswith(IMAGE_EXTENSIONS))
+    queue = WorkQueue(queue_path)
+    added = queue.enqueue(image_files)
+    logger.info(f"Queued {added} new images ({len(image_files)} in {input_folder}) in {queue_path}")
+
+    try:
+        while wait:
+            counts = queue.counts()
+            for state, count in counts.items():
+                telemetry.QUEUE_DEPTH.set(count, queue='work_' + state)
+            logger.info(f"Queue: {counts} | active workers: {queue.workers()}")
+            if counts['pending'] == 0 and counts['leased'] == 0:
+                break
+            time.sleep(WORK_QUEUE_SETTINGS['poll_interval'])
+    except KeyboardInterrupt:
+        logger.info("Coordinator stopped; queued items stay available to workers")
+        return queue.counts()
+    finally:
+        counts = queue.counts()
+        queue.close()
+
+    if wait:
+        store = ResultsStore(store_path_for(output_file), shared=True)
+        store.add_batch({
+            'processing_date': datetime.now().isoformat(),
+            'input_folder': input_folder,
+            'total_images': len(image_files),
+            'successful': counts['done'],
+            'failed': counts['failed']
+        })
+        store.close()
+        logger.info(f"Queue drained: {counts['done']} done, {counts['failed']} failed")
+    return counts
+
+
+def run_worker(queue_path, output_file="batch_results.json", processor=None, worker_id=None, exit_when_empty=False):
+    """Claim, process and ack leased images until the queue is empty (or forever)"""
+    from batch_processor import BatchInvoiceProcessor
+
+    worker_id = worker_id or default_worker_id()
+    processor = processor or BatchInvoiceProcessor()
+    queue = WorkQueue(queue_path)
+    store = ResultsStore(store_path_for(output_file), shared=True)
+    store.mark_authoritative()
+    claim_size = WORK_QUEUE_SETTINGS['claim_size']
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_loop, daemon=True,
+                                 args=(queue_path, worker_id, stop, WORK_QUEUE_SETTINGS['heartbeat_interval']))
+    heartbeat.start()
+    logger.info(f"Worker {worker_id} polling {queue_path}")
+
+    processed = 0
+    try:
+        while True:
+            leased = queue.claim(worker_id, claim_size)
+            if not leased:
+                if exit_when_empty and queue.counts()['leased'] == 0:
+                    break
+                time.sleep(WORK_QUEUE_SETTINGS['poll_interval'])
+                continue
+
+            for image_path, result, error in processor._process(leased):
+                if error is None and 'error' not in result:
+                    store.add_result(image_path, result)
+                    queue.ack(worker_id, image_path)
+                    processed += 1
+                    logger.info(f"  ✓ {os.path.basename(image_path)}")
+                else:
+                    error = error or result['error']
+                    logger.error(f"  ✗ {os.path.basename(image_path)}: {error}")
+                    queue.fail(worker_id, image_path, error)
+    except KeyboardInterrupt:
+        logger.info("Worker stopped; unacked leases will expire and be re-leased")
+    finally:
+        stop.set()
+        heartbeat.join()
+        queue.close()
+        store.close()
+        processor.close()
+    logger.info(f"Worker {worker_id} processed {processed} images")
+    return processed
+
+
+def main():
+    import argparse
+    from batch_processor import BatchInvoiceProcessor
+    from resource_manager import ResourceManager
+
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Distribute batch extraction over a shared SQLite work queue")
+    parser.add_argument("role", choices=['coordinator', 'worker'])
+    parser.add_argument("input_folder", nargs='?', help="Folder to queue (coordinator only)")
+    parser.add_argument("--queue", "-q", default="work_queue.db", help="Queue file every node can reach")
+    parser.add_argument("--results", "-r", default="batch_results.json",
+                        help="Results file; its .db store is shared by all workers")
+    parser.add_argument("--workers", type=int, help="Worker processes on this node")
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--no-wait", action="store_true", help="Coordinator: queue and exit")
+    parser.add_argument("--exit-when-empty", action="store_true", help="Worker: stop once the queue is drained")
+
+    args = parser.parse_args()
+
+    if args.role == 'coordinator':
+        if not args.input_folder or not os.path.isdir(args.input_folder):
+            print("Error: coordinator needs an existing input folder")
+            return
+        run_coordinator(args.input_folder, args.queue, args.results, wait=not args.no_wait)
+    else:
+        processor = BatchInvoiceProcessor(ResourceManager(workers=args.workers), pipelined=args.pipelined)
+        run_worker(args.queue, args.results, processor, exit_when_empty=args.exit_when_empty)
+
+
+if __name__ == "__main__":
+    main()